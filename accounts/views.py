@@ -5,7 +5,7 @@ from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView as BaseTokenObtainPairView
 from django.contrib.auth import get_user_model
-from django.db import transaction
+from carts.services import merge_session_cart
 from .serializers import UserRegistrationSerializer, UserSerializer, ChangePasswordSerializer
 
 User = get_user_model()
@@ -22,7 +22,7 @@ class UserRegistrationView(generics.CreateAPIView):
         user = serializer.save()
         
         # Merge anonymous cart if exists
-        self.merge_session_cart(request, user)
+        merge_session_cart(request.session.session_key, user)
         
         refresh = RefreshToken.for_user(user)
         
@@ -34,38 +34,6 @@ class UserRegistrationView(generics.CreateAPIView):
             },
             'message': 'User registered successfully'
         }, status=status.HTTP_201_CREATED)
-    
-    def merge_session_cart(self, request, user):
-        """Merge session cart into user cart on registration"""
-        from carts.models import Cart, CartItem
-        
-        session_key = request.session.session_key
-        if not session_key:
-            return
-        
-        try:
-            session_cart = Cart.objects.get(session_key=session_key, user=None)
-        except Cart.DoesNotExist:
-            return
-        
-        # Get or create user cart
-        user_cart, created = Cart.objects.get_or_create(user=user, session_key=None)
-        
-        with transaction.atomic():
-            for session_item in session_cart.items.all():
-                user_item, created = CartItem.objects.get_or_create(
-                    cart=user_cart,
-                    product=session_item.product,
-                    defaults={'quantity': session_item.quantity}
-                )
-                
-                if not created:
-                    # Item exists, add quantities
-                    user_item.quantity += session_item.quantity
-                    user_item.save()
-            
-            # Delete session cart
-            session_cart.delete()
 
 
 class TokenObtainPairView(BaseTokenObtainPairView):
@@ -82,41 +50,9 @@ class TokenObtainPairView(BaseTokenObtainPairView):
             user_id = token['user_id']
             
             user = User.objects.get(id=user_id)
-            self.merge_session_cart(request, user)
+            merge_session_cart(request.session.session_key, user)
         
         return response
-    
-    def merge_session_cart(self, request, user):
-        """Merge session cart into user cart on login"""
-        from carts.models import Cart, CartItem
-        
-        session_key = request.session.session_key
-        if not session_key:
-            return
-        
-        try:
-            session_cart = Cart.objects.get(session_key=session_key, user=None)
-        except Cart.DoesNotExist:
-            return
-        
-        # Get or create user cart
-        user_cart, created = Cart.objects.get_or_create(user=user, session_key=None)
-        
-        with transaction.atomic():
-            for session_item in session_cart.items.all():
-                user_item, created = CartItem.objects.get_or_create(
-                    cart=user_cart,
-                    product=session_item.product,
-                    defaults={'quantity': session_item.quantity}
-                )
-                
-                if not created:
-                    # Item exists, add quantities
-                    user_item.quantity += session_item.quantity
-                    user_item.save()
-            
-            # Delete session cart
-            session_cart.delete()
 
 
 class UserProfileView(generics.RetrieveUpdateAPIView):
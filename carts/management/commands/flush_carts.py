@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from carts.store import get_cart_store
+
+
+class Command(BaseCommand):
+    help = 'Write carts changed in the hot cart store back to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        store = get_cart_store()
+        if store is None:
+            raise CommandError("CART_STORE is not 'redis', carts are already stored in the database")
+
+        flushed = store.flush_dirty(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Flushed {flushed} carts'))
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Cart, CartItem
+from products.inventory import stock_level
 from products.models import Product
 from products.serializers import ProductListSerializer
 
@@ -37,9 +38,10 @@ class CartItemSerializer(serializers.ModelSerializer):
         
         try:
             product = Product.objects.get(id=product_id)
-            if quantity > product.stock:
+            stock = stock_level(product)
+            if quantity > stock:
                 raise serializers.ValidationError({
-                    'quantity': f'Only {product.stock} items available in stock'
+                    'quantity': f'Only {stock} items available in stock'
                 })
         except Product.DoesNotExist:
             pass
@@ -58,10 +60,22 @@ class CartSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'created_at', 'updated_at')
     
     def get_total_items(self, obj):
-        return sum(item.quantity for item in obj.items.all())
+        return self.get_totals(obj)[0]
     
     def get_total_amount(self, obj):
-        return sum(item.product.price * item.quantity for item in obj.items.all())
+        return self.get_totals(obj)[1]
+    
+    def get_totals(self, obj):
+        """Item count and amount from a single pass over the (prefetched) items"""
+        if getattr(self, '_totals_for', None) is not obj:
+            total_items = 0
+            total_amount = 0
+            for item in obj.items.all():
+                total_items += item.quantity
+                total_amount += item.product.price * item.quantity
+            self._totals_for = obj
+            self._totals = (total_items, total_amount)
+        return self._totals
 
 
 class AddToCartSerializer(serializers.Serializer):
@@ -87,11 +101,13 @@ class AddToCartSerializer(serializers.Serializer):
         quantity = attrs.get('quantity')
         
         product = Product.objects.get(id=product_id)
-        if quantity > product.stock:
+        stock = stock_level(product)
+        if quantity > stock:
             raise serializers.ValidationError({
-                'quantity': f'Only {product.stock} items available in stock'
+                'quantity': f'Only {stock} items available in stock'
             })
         
+        attrs['product'] = product
         return attrs
 
 
@@ -103,4 +119,19 @@ class UpdateCartItemSerializer(serializers.Serializer):
             raise serializers.ValidationError("Quantity must be greater than 0")
         if value > 999:
             raise serializers.ValidationError("Quantity cannot exceed 999")
-        return value
\ No newline at end of file
+        return value
+
+
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'update', 'remove'])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(required=False, min_value=1, max_value=999)
+    
+    def validate(self, attrs):
+        if attrs['op'] != 'remove' and 'quantity' not in attrs:
+            raise serializers.ValidationError({'quantity': 'This field is required.'})
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=100)
@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models import Q
+
+from products.inventory import available_stock
+from .models import Cart, CartItem
+from .store import cart_owner, persist_carts
+
+
+def merge_session_cart(session_key, user):
+    """Merge an anonymous session cart into the user's cart, clamping quantities to stock"""
+    if not session_key:
+        return
+
+    persist_carts(cart_owner(session_key=session_key), cart_owner(user=user))
+
+    with transaction.atomic():
+        # Items of both carts with the stock they are clamped to, in one query
+        rows = list(CartItem.objects.filter(
+            Q(cart__session_key=session_key, cart__user=None) | Q(cart__user=user, cart__session_key=None)
+        ).values('cart_id', 'cart__user_id', 'product_id', 'quantity', stock=available_stock('product__')))
+
+        session_rows = [row for row in rows if row['cart__user_id'] is None]
+        if not session_rows:
+            # Nothing to merge, but an empty guest cart must not outlive the login either
+            Cart.objects.filter(session_key=session_key, user=None).delete()
+            return
+
+        user_rows = [row for row in rows if row['cart__user_id'] is not None]
+        if user_rows:
+            user_cart_id = user_rows[0]['cart_id']
+        else:
+            user_cart_id = Cart.objects.get_or_create(user=user, session_key=None)[0].id
+
+        quantities = {row['product_id']: row['quantity'] for row in user_rows if row['cart_id'] == user_cart_id}
+        merged = []
+        for row in session_rows:
+            quantity = min(quantities.get(row['product_id'], 0) + row['quantity'], row['stock'])
+            if quantity > 0:
+                merged.append(CartItem(cart_id=user_cart_id, product_id=row['product_id'], quantity=quantity))
+
+        CartItem.objects.bulk_create(
+            merged,
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity'],
+        )
+        Cart.objects.filter(session_key=session_key, user=None).delete()
@@ -0,0 +1,315 @@
+import threading
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Cart, CartItem
+
+# Marks a hash as loaded even when the cart has no items
+LOADED_FIELD = '_loaded'
+# Bumped on every write, so a flushed snapshot can tell whether the cart changed since
+VERSION_FIELD = '_version'
+META_FIELDS = (LOADED_FIELD, VERSION_FIELD)
+DIRTY_SET = 'carts:dirty'
+# Drops a cart hash only while its version is still the one that was flushed
+FORGET_IF_UNCHANGED = """
+if (redis.call('hget', KEYS[1], ARGV[1]) or '') == ARGV[2] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+# Seeds a cart hash from field/value pairs (the first being LOADED_FIELD) unless another request
+# already did; HSETNX keeps any item a concurrent write got in first
+SEED_CART = """
+if redis.call('hexists', KEYS[1], ARGV[1]) == 1 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    redis.call('hsetnx', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+
+def cart_owner(user=None, session_key=None):
+    """Store key for a user cart or an anonymous session cart"""
+    if user is not None:
+        return f'user:{user.pk}'
+    return f'session:{session_key}'
+
+
+class HotCart:
+    """Read-only cart built from the store, shaped for CartSerializer"""
+
+    class Items(list):
+        def all(self):
+            return self
+
+    def __init__(self, items):
+        self.id = None
+        self.items = self.Items(items)
+        self.created_at = None
+        self.updated_at = None
+
+
+class InMemoryRedis:
+    """Minimal stand-in for the Redis commands the cart store uses"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def exists(self, key):
+        return int(key in self._data)
+
+    def hgetall(self, key):
+        return dict(self._data.get(key, {}))
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self._lock:
+            values = self._data.setdefault(key, {})
+            if field is not None:
+                values[field] = str(value)
+            for name, item in (mapping or {}).items():
+                values[name] = str(item)
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            values = self._data.setdefault(key, {})
+            values[field] = str(int(values.get(field, 0)) + amount)
+            return int(values[field])
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            values = self._data.get(key, {})
+            return sum(values.pop(field, None) is not None for field in fields)
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def expire(self, key, seconds):
+        return int(key in self._data)
+
+    def sadd(self, key, *members):
+        with self._lock:
+            self._data.setdefault(key, set()).update(members)
+
+    def spop(self, key, count=1):
+        with self._lock:
+            members = self._data.get(key, set())
+            return [members.pop() for _ in range(min(count, len(members)))]
+
+    def register_script(self, script):
+        """Only FORGET_IF_UNCHANGED and SEED_CART are supported, run atomically under the lock"""
+        def forget_if_unchanged(keys, args):
+            key, (field, version) = keys[0], args
+            if self._data.get(key, {}).get(field, '') != version:
+                return 0
+            return int(self._data.pop(key, None) is not None)
+
+        def seed_cart(keys, args):
+            values = self._data.setdefault(keys[0], {})
+            if args[0] in values:
+                return 0
+            for name, item in zip(args[::2], args[1::2]):
+                values.setdefault(name, str(item))
+            return 1
+
+        run = {FORGET_IF_UNCHANGED: forget_if_unchanged, SEED_CART: seed_cart}[script]
+
+        def locked(keys, args):
+            with self._lock:
+                return run(keys, args)
+
+        return locked
+
+
+class HotCartStore:
+    """Active carts kept as one Redis hash per cart and written behind to the database"""
+
+    def __init__(self, client, ttl=None):
+        self.client = client
+        self.ttl = ttl
+        self.forget_if_unchanged = client.register_script(FORGET_IF_UNCHANGED)
+        self.seed_cart = client.register_script(SEED_CART)
+
+    def cart_key(self, owner):
+        return f'cart:{owner}'
+
+    def load(self, owner):
+        """Seed the hash from the database the first time a cart is touched"""
+        key = self.cart_key(owner)
+        if self.client.exists(key):
+            return
+        args = [LOADED_FIELD, 1]
+        for product_id, quantity in self.database_items(owner):
+            args += [str(product_id), quantity]
+        # Another request may have seeded the cart and written to it since the exists check
+        self.seed_cart(keys=[key], args=args)
+        self.touch(owner, dirty=False)
+
+    def database_items(self, owner):
+        kind, value = owner.split(':', 1)
+        if kind == 'user':
+            items = CartItem.objects.filter(cart__user_id=value, cart__session_key=None)
+        else:
+            items = CartItem.objects.filter(cart__session_key=value, cart__user=None)
+        return items.order_by('added_at', 'id').values_list('product_id', 'quantity')
+
+    def touch(self, owner, dirty=True):
+        if dirty:
+            self.client.hincrby(self.cart_key(owner), VERSION_FIELD, 1)
+            self.client.sadd(DIRTY_SET, owner)
+        if self.ttl:
+            self.client.expire(self.cart_key(owner), self.ttl)
+
+    def get_items(self, owner):
+        """Product id -> quantity for a cart"""
+        self.load(owner)
+        return self.parse_items(self.client.hgetall(self.cart_key(owner)))
+
+    def parse_items(self, values):
+        return {
+            int(product_id): int(quantity)
+            for product_id, quantity in values.items()
+            if product_id not in META_FIELDS
+        }
+
+    def add(self, owner, product_id, quantity):
+        self.load(owner)
+        new_quantity = self.client.hincrby(self.cart_key(owner), str(product_id), quantity)
+        self.touch(owner)
+        return new_quantity
+
+    def set(self, owner, product_id, quantity):
+        self.load(owner)
+        self.client.hset(self.cart_key(owner), str(product_id), quantity)
+        self.touch(owner)
+
+    def remove(self, owner, product_id):
+        self.load(owner)
+        removed = self.client.hdel(self.cart_key(owner), str(product_id))
+        self.touch(owner)
+        return bool(removed)
+
+    def replace(self, owner, quantities, removed=()):
+        """Set several quantities and drop several products in one go"""
+        self.load(owner)
+        key = self.cart_key(owner)
+        if quantities:
+            self.client.hset(key, mapping={str(product_id): quantity for product_id, quantity in quantities.items()})
+        if removed:
+            self.client.hdel(key, *[str(product_id) for product_id in removed])
+        self.touch(owner)
+
+    def clear(self, owner):
+        self.load(owner)
+        key = self.cart_key(owner)
+        # Drop only the items, the version has to keep counting up across a clear
+        fields = [field for field in self.client.hgetall(key) if field not in META_FIELDS]
+        if fields:
+            self.client.hdel(key, *fields)
+        self.touch(owner)
+
+    def flush(self, owners, forget=False):
+        """Write the given carts to the Cart/CartItem tables in one transaction
+
+        With forget, each cart is then dropped from the store unless it was written to
+        after its snapshot was taken, so a concurrent write is never lost.
+        """
+        snapshots = {}
+        versions = {}
+        for owner in owners:
+            values = self.client.hgetall(self.cart_key(owner))
+            if values:
+                snapshots[owner] = self.parse_items(values)
+                versions[owner] = values.get(VERSION_FIELD, '')
+        if not snapshots:
+            return 0
+
+        user_ids = [owner.split(':', 1)[1] for owner in snapshots if owner.startswith('user:')]
+        session_keys = [owner.split(':', 1)[1] for owner in snapshots if owner.startswith('session:')]
+
+        with transaction.atomic():
+            carts = {}
+            for cart in Cart.objects.filter(user_id__in=user_ids, session_key=None):
+                carts[f'user:{cart.user_id}'] = cart
+            for cart in Cart.objects.filter(session_key__in=session_keys, user=None):
+                carts[cart_owner(session_key=cart.session_key)] = cart
+
+            missing = [owner for owner in snapshots if owner not in carts]
+            new_carts = []
+            for owner in missing:
+                kind, value = owner.split(':', 1)
+                if kind == 'user':
+                    new_carts.append(Cart(user_id=value))
+                else:
+                    new_carts.append(Cart(session_key=value))
+            for owner, cart in zip(missing, Cart.objects.bulk_create(new_carts)):
+                carts[owner] = cart
+
+            items = [
+                CartItem(cart=carts[owner], product_id=product_id, quantity=quantity)
+                for owner, quantities in snapshots.items()
+                for product_id, quantity in quantities.items()
+            ]
+            CartItem.objects.bulk_create(
+                items,
+                update_conflicts=True,
+                unique_fields=['cart', 'product'],
+                update_fields=['quantity'],
+            )
+            stale = [
+                Q(cart_id=carts[owner].id) & ~Q(product_id__in=list(quantities))
+                for owner, quantities in snapshots.items()
+            ]
+            CartItem.objects.filter(reduce(or_, stale)).delete()
+
+        if forget:
+            for owner, version in versions.items():
+                self.forget_if_unchanged(keys=[self.cart_key(owner)], args=[VERSION_FIELD, version])
+        return len(snapshots)
+
+    def flush_dirty(self, batch_size=500):
+        """Flush carts changed since the last run, batch by batch"""
+        flushed = 0
+        while True:
+            owners = self.client.spop(DIRTY_SET, batch_size)
+            if not owners:
+                return flushed
+            try:
+                flushed += self.flush(owners)
+            except Exception:
+                self.client.sadd(DIRTY_SET, *owners)
+                raise
+
+
+_stores = {}
+
+
+def get_cart_store():
+    """Hot cart store when CART_STORE is 'redis', otherwise None (plain database carts)"""
+    if settings.CART_STORE != 'redis':
+        return None
+
+    url = settings.CART_REDIS_URL
+    if url not in _stores:
+        if url == 'memory://':
+            client = InMemoryRedis()
+        else:
+            import redis
+            client = redis.Redis.from_url(url, decode_responses=True)
+        _stores[url] = HotCartStore(client, ttl=settings.CART_STORE_TTL)
+    return _stores[url]
+
+
+def persist_carts(*owners):
+    """Write hot carts through and drop them, before code that reads the Cart tables directly"""
+    store = get_cart_store()
+    if store is None:
+        return
+    store.flush(owners, forget=True)
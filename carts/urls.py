@@ -8,5 +8,6 @@ urlpatterns = [
         'patch': 'update_item',
         'delete': 'remove_item'
     }), name='cart-item'),
+    path('cart/batch/', CartViewSet.as_view({'post': 'batch'}), name='cart-batch'),
     path('cart/clear/', CartViewSet.as_view({'delete': 'clear'}), name='cart-clear'),
 ]
\ No newline at end of file
@@ -3,57 +3,111 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from .models import Cart, CartItem
+from .store import HotCart, cart_owner, get_cart_store
+from products.inventory import available_stock, stock_level
 from products.models import Product
 from .serializers import (
     CartSerializer, 
     CartItemSerializer, 
     AddToCartSerializer,
-    UpdateCartItemSerializer
+    UpdateCartItemSerializer,
+    CartBatchSerializer
 )
 
 
+def cart_items_prefetch():
+    """Items with their products and categories, everything CartSerializer renders"""
+    return Prefetch(
+        'items',
+        queryset=CartItem.objects.select_related('product__category').order_by('added_at', 'id')
+    )
+
+
+def plan_batch(current, operations, products):
+    """Apply operations in order to a {product_id: quantity} copy, collecting per-operation errors"""
+    quantities = dict(current)
+    errors = {}
+    for index, operation in enumerate(operations):
+        product_id = operation['product_id']
+        if operation['op'] == 'remove':
+            if quantities.pop(product_id, None) is None:
+                errors[index] = 'Cart item not found'
+            continue
+        
+        product = products.get(product_id)
+        if product is None:
+            errors[index] = 'Product not found or inactive'
+            continue
+        if operation['op'] == 'update' and product_id not in quantities:
+            errors[index] = 'Cart item not found'
+            continue
+        
+        quantity = operation['quantity']
+        if operation['op'] == 'add':
+            quantity += quantities.get(product_id, 0)
+        if quantity > product.available_stock:
+            errors[index] = f'Only {product.available_stock} items available in stock'
+            continue
+        quantities[product_id] = quantity
+    return quantities, errors
+
+
 class CartViewSet(viewsets.GenericViewSet):
     permission_classes = [AllowAny]
     serializer_class = CartSerializer
     
+    def serialize_cart(self, cart):
+        """Serialize a cart with its items loaded in one query"""
+        if hasattr(cart, '_prefetched_objects_cache'):
+            cart._prefetched_objects_cache.pop('items', None)
+        prefetch_related_objects([cart], cart_items_prefetch())
+        return CartSerializer(cart).data
+    
+    def get_session_key(self, request):
+        session_key = request.session.session_key
+        if not session_key:
+            request.session.create()
+            session_key = request.session.session_key
+        return session_key
+    
     def get_or_create_cart(self, request):
         """Get or create cart for authenticated user or session"""
         if request.user.is_authenticated:
             cart, created = Cart.objects.get_or_create(user=request.user, session_key=None)
         else:
-            session_key = request.session.session_key
-            if not session_key:
-                request.session.create()
-                session_key = request.session.session_key
-            
+            session_key = self.get_session_key(request)
             cart, created = Cart.objects.get_or_create(session_key=session_key, user=None)
         
         return cart
     
-    def merge_carts(self, session_cart, user_cart):
-        """Merge session cart into user cart on login"""
-        for session_item in session_cart.items.all():
-            user_item, created = CartItem.objects.get_or_create(
-                cart=user_cart,
-                product=session_item.product,
-                defaults={'quantity': session_item.quantity}
-            )
-            
-            if not created:
-                # Item already exists, add quantities
-                user_item.quantity += session_item.quantity
-                user_item.save()
-        
-        # Delete session cart
-        session_cart.delete()
+    def get_cart_owner(self, request):
+        """Hot store key for the current user or session cart"""
+        if request.user.is_authenticated:
+            return cart_owner(user=request.user)
+        return cart_owner(session_key=self.get_session_key(request))
+    
+    def serialize_hot_cart(self, store, owner):
+        """Serialize a hot cart, item ids are product ids in this mode"""
+        quantities = store.get_items(owner)
+        products = Product.objects.select_related('category').in_bulk(list(quantities))
+        items = [
+            CartItem(id=product_id, product=products[product_id], quantity=quantity)
+            for product_id, quantity in quantities.items()
+            if product_id in products
+        ]
+        return CartSerializer(HotCart(items)).data
     
     @action(detail=False, methods=['get'])
     def view(self, request):
         """Get current cart"""
+        store = get_cart_store()
+        if store is not None:
+            return Response(self.serialize_hot_cart(store, self.get_cart_owner(request)))
+        
         cart = self.get_or_create_cart(request)
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        return Response(self.serialize_cart(cart))
     
     @action(detail=False, methods=['post'])
     def add_item(self, request):
@@ -61,11 +115,14 @@ class CartViewSet(viewsets.GenericViewSet):
         serializer = AddToCartSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        product_id = serializer.validated_data['product_id']
         quantity = serializer.validated_data['quantity']
+        product = serializer.validated_data['product']
+        
+        store = get_cart_store()
+        if store is not None:
+            return self.hot_add_item(request, store, product, quantity)
         
         cart = self.get_or_create_cart(request)
-        product = Product.objects.get(id=product_id)
         
         with transaction.atomic():
             cart_item, created = CartItem.objects.get_or_create(
@@ -78,17 +135,17 @@ class CartViewSet(viewsets.GenericViewSet):
                 # Item already in cart, update quantity
                 new_quantity = cart_item.quantity + quantity
                 
-                if new_quantity > product.stock:
+                stock = stock_level(product)
+                if new_quantity > stock:
                     return Response(
-                        {'error': f'Only {product.stock} items available in stock'},
+                        {'error': f'Only {stock} items available in stock'},
                         status=status.HTTP_400_BAD_REQUEST
                     )
                 
                 cart_item.quantity = new_quantity
                 cart_item.save()
         
-        cart_serializer = CartSerializer(cart)
-        return Response(cart_serializer.data, status=status.HTTP_200_OK)
+        return Response(self.serialize_cart(cart), status=status.HTTP_200_OK)
     
     @action(detail=False, methods=['patch'], url_path='items/(?P<item_id>[^/.]+)')
     def update_item(self, request, item_id=None):
@@ -96,10 +153,14 @@ class CartViewSet(viewsets.GenericViewSet):
         serializer = UpdateCartItemSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
+        store = get_cart_store()
+        if store is not None:
+            return self.hot_update_item(request, store, item_id, serializer.validated_data['quantity'])
+        
         cart = self.get_or_create_cart(request)
         
         try:
-            cart_item = CartItem.objects.get(id=item_id, cart=cart)
+            cart_item = CartItem.objects.select_related('product').get(id=item_id, cart=cart)
         except CartItem.DoesNotExist:
             return Response(
                 {'error': 'Cart item not found'},
@@ -108,21 +169,32 @@ class CartViewSet(viewsets.GenericViewSet):
         
         quantity = serializer.validated_data['quantity']
         
-        if quantity > cart_item.product.stock:
+        stock = stock_level(cart_item.product)
+        if quantity > stock:
             return Response(
-                {'error': f'Only {cart_item.product.stock} items available in stock'},
+                {'error': f'Only {stock} items available in stock'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         cart_item.quantity = quantity
         cart_item.save()
         
-        cart_serializer = CartSerializer(cart)
-        return Response(cart_serializer.data)
+        return Response(self.serialize_cart(cart))
     
     @action(detail=False, methods=['delete'], url_path='items/(?P<item_id>[^/.]+)')
     def remove_item(self, request, item_id=None):
         """Remove item from cart"""
+        store = get_cart_store()
+        if store is not None:
+            owner = self.get_cart_owner(request)
+            # Item ids are product ids here, never let one name the hash's own fields
+            if not str(item_id).isdigit() or not store.remove(owner, item_id):
+                return Response(
+                    {'error': 'Cart item not found'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            return Response(self.serialize_hot_cart(store, owner))
+        
         cart = self.get_or_create_cart(request)
         
         try:
@@ -134,14 +206,114 @@ class CartViewSet(viewsets.GenericViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        cart_serializer = CartSerializer(cart)
-        return Response(cart_serializer.data)
+        return Response(self.serialize_cart(cart))
     
     @action(detail=False, methods=['delete'])
     def clear(self, request):
         """Clear entire cart"""
+        store = get_cart_store()
+        if store is not None:
+            owner = self.get_cart_owner(request)
+            store.clear(owner)
+            return Response(self.serialize_hot_cart(store, owner))
+        
         cart = self.get_or_create_cart(request)
         cart.items.all().delete()
         
-        cart_serializer = CartSerializer(cart)
-        return Response(cart_serializer.data)
\ No newline at end of file
+        return Response(self.serialize_cart(cart))
+    
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Apply a list of add/update/remove operations atomically"""
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['operations']
+        
+        product_ids = {operation['product_id'] for operation in operations if operation['op'] != 'remove'}
+        products = Product.objects.filter(id__in=product_ids, is_active=True).annotate(
+            available_stock=available_stock()
+        ).in_bulk()
+        
+        store = get_cart_store()
+        if store is not None:
+            owner = self.get_cart_owner(request)
+            current = store.get_items(owner)
+            quantities, errors = plan_batch(current, operations, products)
+            if errors:
+                return self.batch_error(errors)
+            changed = {
+                product_id: quantity for product_id, quantity in quantities.items()
+                if current.get(product_id) != quantity
+            }
+            store.replace(owner, changed, removed=current.keys() - quantities.keys())
+            return Response(self.serialize_hot_cart(store, owner))
+        
+        cart = self.get_or_create_cart(request)
+        with transaction.atomic():
+            # Lock the cart so concurrent batches apply one after the other
+            Cart.objects.select_for_update().filter(pk=cart.pk).exists()
+            items = {item.product_id: item for item in cart.items.all()}
+            current = {product_id: item.quantity for product_id, item in items.items()}
+            
+            quantities, errors = plan_batch(current, operations, products)
+            if errors:
+                return self.batch_error(errors)
+            
+            new_items = []
+            changed_items = []
+            for product_id, quantity in quantities.items():
+                item = items.get(product_id)
+                if item is None:
+                    new_items.append(CartItem(cart=cart, product_id=product_id, quantity=quantity))
+                elif item.quantity != quantity:
+                    item.quantity = quantity
+                    changed_items.append(item)
+            removed = current.keys() - quantities.keys()
+            
+            if new_items:
+                CartItem.objects.bulk_create(new_items)
+            if changed_items:
+                CartItem.objects.bulk_update(changed_items, ['quantity'])
+            if removed:
+                cart.items.filter(product_id__in=removed).delete()
+        
+        return Response(self.serialize_cart(cart))
+    
+    def batch_error(self, errors):
+        return Response(
+            {'error': 'Cart batch rejected, no changes were applied', 'operations': errors},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    def hot_add_item(self, request, store, product, quantity):
+        owner = self.get_cart_owner(request)
+        
+        new_quantity = store.add(owner, product.id, quantity)
+        stock = stock_level(product)
+        if new_quantity > stock:
+            store.add(owner, product.id, -quantity)
+            return Response(
+                {'error': f'Only {stock} items available in stock'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(self.serialize_hot_cart(store, owner), status=status.HTTP_200_OK)
+    
+    def hot_update_item(self, request, store, item_id, quantity):
+        owner = self.get_cart_owner(request)
+        product_id = int(item_id) if str(item_id).isdigit() else None
+        if product_id not in store.get_items(owner):
+            return Response(
+                {'error': 'Cart item not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        stock = stock_level(Product.objects.get(id=product_id))
+        if quantity > stock:
+            return Response(
+                {'error': f'Only {stock} items available in stock'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        store.set(owner, product_id, quantity)
+        return Response(self.serialize_hot_cart(store, owner))
\ No newline at end of file
@@ -0,0 +1,98 @@
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class OptionalCountPagination(pagination.PageNumberPagination):
+    """Page number pagination that skips COUNT(*) when the client passes ?count=false"""
+    count_query_param = 'count'
+
+    def skip_count(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() == 'false'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_skipped = self.skip_count(request)
+        if not self.count_skipped:
+            return super().paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        try:
+            page_number = int(request.query_params.get(self.page_query_param, 1))
+            if page_number < 1:
+                raise ValueError
+        except ValueError:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=request.query_params.get(self.page_query_param),
+                message='Invalid page.'
+            ))
+
+        # Fetch one extra row to know whether a next page exists
+        offset = (page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        if not rows and page_number > 1:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message='That page contains no results'
+            ))
+
+        self.request = request
+        self.page_number = page_number
+        self.has_next = len(rows) > page_size
+        self.display_page_controls = False
+        return rows[:page_size]
+
+    def get_next_link(self):
+        if not self.count_skipped:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if not self.count_skipped:
+            return super().get_previous_link()
+        if self.page_number <= 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+    def get_paginated_response(self, data):
+        if not self.count_skipped:
+            return super().get_paginated_response(data)
+        return Response({
+            'count': None,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class OrderingCursorPagination(pagination.CursorPagination):
+    """Keyset pagination that follows the view ordering with an id tiebreaker"""
+    ordering = ('-created_at', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            tiebreaker = '-id' if ordering[0].startswith('-') else 'id'
+            ordering += (tiebreaker,)
+        return ordering
+
+
+class CursorPaginationMixin:
+    """Lets list endpoints opt into keyset pagination with ?pagination=cursor"""
+    cursor_pagination_class = OrderingCursorPagination
+    pagination_mode_param = 'pagination'
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.request is not None:
+            if self.request.query_params.get(self.pagination_mode_param) == 'cursor':
+                self._paginator = self.cursor_pagination_class()
+        return super().paginator
@@ -77,10 +77,75 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Seconds a writer waits for the database lock before "database is locked";
+        # checkout transactions take that lock up front (orders.services.begin_write)
+        'OPTIONS': {
+            'timeout': 20,
+        },
     }
 }
 
 
+# Cache
+# Local memory by default; set REDIS_URL to share the cache between workers.
+
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds a cached product list page is kept (pages are also versioned)
+PRODUCT_LIST_CACHE_TIMEOUT = config('PRODUCT_LIST_CACHE_TIMEOUT', default=300, cast=int)
+
+# Type-ahead index size cap per process, the newest products are kept (about 50 MiB per 100k)
+SUGGESTION_INDEX_MAX_PRODUCTS = config('SUGGESTION_INDEX_MAX_PRODUCTS', default=100_000, cast=int)
+
+
+# Cart storage: 'database' (default) or 'redis' for the write-behind hot cart store.
+# CART_REDIS_URL='memory://' uses an in-process fake, for tests and local runs.
+CART_STORE = config('CART_STORE', default='database')
+CART_REDIS_URL = config('CART_REDIS_URL', default=REDIS_URL or 'memory://')
+CART_STORE_TTL = config('CART_STORE_TTL', default=7 * 24 * 3600, cast=int)
+
+
+# Unpaid orders hold their stock this long before release_expired_reservations puts it back.
+# Keep it longer than the payment gateway's checkout window.
+STOCK_RESERVATION_TTL_MINUTES = config('STOCK_RESERVATION_TTL_MINUTES', default=30, cast=int)
+
+
+# Checkout: 'sync' creates the order inside the request, 'async' queues it for the Celery
+# worker and answers 202 with a ticket to poll.
+CHECKOUT_MODE = config('CHECKOUT_MODE', default='sync')
+CHECKOUT_BATCH_SIZE = config('CHECKOUT_BATCH_SIZE', default=100, cast=int)
+
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default=REDIS_URL or 'memory://')
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=False, cast=bool)
+
+
+# Responses stored for Idempotency-Key retries are replayed for this long
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=24 * 3600, cast=int)
+# A request still running after this long is taken as abandoned and the key can be retried
+IDEMPOTENCY_LEASE_SECONDS = config('IDEMPOTENCY_LEASE_SECONDS', default=300, cast=int)
+
+
+# Admin analytics dashboard: fresh for ANALYTICS_CACHE_TTL seconds, then served stale for up to
+# ANALYTICS_STALE_TTL more while one request rebuilds it in the background
+ANALYTICS_CACHE_TTL = config('ANALYTICS_CACHE_TTL', default=60, cast=int)
+ANALYTICS_STALE_TTL = config('ANALYTICS_STALE_TTL', default=300, cast=int)
+ANALYTICS_DASHBOARD_WORKERS = config('ANALYTICS_DASHBOARD_WORKERS', default=4, cast=int)
+
+
 # Password validation
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -126,7 +191,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'ecommerce_backend.pagination.OptionalCountPagination',
     'PAGE_SIZE': 50,
 }
 
@@ -0,0 +1,85 @@
+import csv
+import json
+from datetime import date, datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import Order, OrderItem
+
+EXPORTS = {
+    'orders': (Order, (
+        'id', 'order_number', 'user_id', 'user__email', 'status', 'payment_status',
+        'total_amount', 'shipping_address', 'created_at', 'updated_at',
+    ), 'created_at'),
+    'items': (OrderItem, (
+        'id', 'order_id', 'order__order_number', 'product_id', 'product__name',
+        'quantity', 'price_at_purchase', 'subtotal',
+    ), 'order__created_at'),
+}
+OUTPUTS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+class ExportError(ValueError):
+    """Unknown export kind or output, or an unparseable date"""
+
+
+def parse_day(value):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f'Invalid date {value!r}, expected YYYY-MM-DD')
+
+
+def export_rows(kind, start=None, end=None, chunk_size=2000):
+    """Rows of an export as dicts, streamed from the database chunk_size at a time
+
+    start and end are inclusive local dates on the order's created_at.
+    """
+    if kind not in EXPORTS:
+        raise ExportError(f'Invalid export. Valid options: {list(EXPORTS)}')
+    model, fields, created_field = EXPORTS[kind]
+
+    queryset = model.objects.all()
+    # Whole-day bounds keep the created_at index usable, unlike a __date lookup
+    if start:
+        queryset = queryset.filter(**{f'{created_field}__gte': timezone.make_aware(datetime.combine(start, time.min))})
+    if end:
+        queryset = queryset.filter(**{
+            f'{created_field}__lt': timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+        })
+    return queryset.order_by('id').values(*fields).iterator(chunk_size=chunk_size)
+
+
+class Echo:
+    """File-like object handing csv.writer's output straight back"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, fields):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([row[field] for field in fields])
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_lines(kind, output, start=None, end=None, chunk_size=2000):
+    """Lines of an export rendered as CSV (with a header row) or JSON Lines"""
+    if output not in OUTPUTS:
+        raise ExportError(f'Invalid output. Valid options: {list(OUTPUTS)}')
+    rows = export_rows(kind, start, end, chunk_size)
+    if output == 'csv':
+        return csv_lines(rows, EXPORTS[kind][1])
+    return jsonl_lines(rows)
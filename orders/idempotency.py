@@ -0,0 +1,121 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+HEADER = 'Idempotency-Key'
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def cache_key(scope, user_id, key):
+    digest = hashlib.md5(key.encode()).hexdigest()
+    return f'idempotency:{scope}:{user_id}:{digest}'
+
+
+def replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return Response(
+            {'error': f'{HEADER} was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = Response(stored['body'], status=stored['status_code'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(scope):
+    """Replay the first response for requests repeating an Idempotency-Key instead of running the view again"""
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view_method(self, request, *args, **kwargs)
+            if len(key) > 255:
+                return Response(
+                    {'error': f'{HEADER} must be at most 255 characters'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            fingerprint = request_fingerprint(request)
+            cached_key = cache_key(scope, request.user.pk, key)
+            stored = cache.get(cached_key)
+            if stored is not None:
+                return replay(stored, fingerprint)
+
+            # The database row claims the key durably, the cache only saves the lookup
+            record, created = IdempotencyRecord.objects.get_or_create(
+                user=request.user, scope=scope, key=key,
+                defaults={'fingerprint': fingerprint}
+            )
+            if not created:
+                now = timezone.now()
+                expired = record.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+                # A request still unanswered after its lease died with its worker, e.g. on a timeout
+                abandoned = (
+                    record.status_code is None
+                    and record.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+                )
+                if expired or abandoned:
+                    # Reclaim the row in place, the created_at guard lets only one retry win
+                    claimed = IdempotencyRecord.objects.filter(pk=record.pk, created_at=record.created_at).update(
+                        fingerprint=fingerprint, status_code=None, response_body=None, created_at=now
+                    )
+                    created = bool(claimed)
+                    record.refresh_from_db()
+            if not created:
+                if record.status_code is None:
+                    return Response(
+                        {'error': f'A request with this {HEADER} is still being processed'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                stored = {
+                    'fingerprint': record.fingerprint,
+                    'status_code': record.status_code,
+                    'body': record.response_body,
+                }
+                cache.set(cached_key, stored, timeout=settings.IDEMPOTENCY_KEY_TTL)
+                return replay(stored, fingerprint)
+
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+            if response.status_code >= 500:
+                # Server errors are not final, let the client retry with the same key
+                record.delete()
+                return response
+
+            body = json.loads(json.dumps(response.data, cls=DjangoJSONEncoder))
+            record.status_code = response.status_code
+            record.response_body = body
+            record.save(update_fields=['status_code', 'response_body'])
+            cache.set(cached_key, {
+                'fingerprint': fingerprint,
+                'status_code': response.status_code,
+                'body': body,
+            }, timeout=settings.IDEMPOTENCY_KEY_TTL)
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired_records():
+    """Delete stored responses past the replay window"""
+    cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted, _ = IdempotencyRecord.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,192 @@
+import random
+import statistics
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+
+from carts.models import Cart, CartItem
+from orders.models import Order, OrderItem
+from orders.services import CheckoutError, cancel_order, checkout_cart
+from products.inventory import enable_sharding, rebalance
+from products.models import Category, Product, ProductStockShard
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Hammer checkout and cancel from concurrent workers and check that stock is never oversold'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--checkouts', type=int, default=50, help='Checkout attempts per worker')
+        parser.add_argument('--products', type=int, default=3, help='Number of scarce products')
+        parser.add_argument('--stock', type=int, default=100, help='Starting stock per product')
+        parser.add_argument('--max-quantity', type=int, default=3)
+        parser.add_argument('--cancel-rate', type=float, default=0.2)
+        parser.add_argument('--shards', type=int, default=0, help='Split each product over this many stock counters')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic users, products and orders')
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        users, products = self.seed(run_id, options)
+        self.stdout.write(
+            f"Database: {connection.vendor}, {options['workers']} workers x {options['checkouts']} checkouts, "
+            f"{len(products)} products with stock {options['stock']}"
+            + (f" in {options['shards']} shards" if options['shards'] else '')
+        )
+
+        try:
+            stats = self.run_workers(users, products, options)
+            self.report(stats)
+            problems = self.check_stock(products, options['stock'])
+        finally:
+            if not options['keep']:
+                self.cleanup(users, products)
+
+        if problems:
+            raise CommandError('Stock invariant violated:\n' + '\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS('No oversell, no negative stock'))
+
+    def seed(self, run_id, options):
+        category = Category.objects.create(name=f'Load Test {run_id}')
+        products = [
+            Product.objects.create(
+                category=category,
+                name=f'Load Test {run_id} Product {i}',
+                price=100,
+                stock=options['stock'],
+            )
+            for i in range(options['products'])
+        ]
+        if options['shards']:
+            for product in products:
+                enable_sharding(product.id, options['shards'])
+        users = [
+            User.objects.create_user(
+                username=f'loadtest-{run_id}-{i}',
+                email=f'loadtest-{run_id}-{i}@example.com',
+                password=None,
+            )
+            for i in range(options['workers'])
+        ]
+        Cart.objects.bulk_create([Cart(user=user) for user in users])
+        return users, products
+
+    def run_workers(self, users, products, options):
+        stats = defaultdict(list)
+        lock = threading.Lock()
+        barrier = threading.Barrier(len(users))
+        carts = {cart.user_id: cart for cart in Cart.objects.filter(user__in=users)}
+
+        def worker(index, user):
+            rng = random.Random(options['seed'] + index)
+            cart = carts[user.id]
+            local = defaultdict(list)
+            barrier.wait()
+            try:
+                for _ in range(options['checkouts']):
+                    lines = rng.sample(products, rng.randint(1, len(products)))
+                    start = time.perf_counter()
+                    try:
+                        # Rejected checkouts leave their lines behind, start every attempt from a fresh cart
+                        CartItem.objects.filter(cart=cart).delete()
+                        CartItem.objects.bulk_create([
+                            CartItem(cart=cart, product=p, quantity=rng.randint(1, options['max_quantity']))
+                            for p in lines
+                        ])
+                    except DatabaseError:
+                        local['errors'].append(time.perf_counter() - start)
+                        continue
+
+                    start = time.perf_counter()
+                    try:
+                        order = checkout_cart(user, 'Load test address')
+                    except CheckoutError:
+                        local['rejected'].append(time.perf_counter() - start)
+                        continue
+                    except DatabaseError:
+                        local['errors'].append(time.perf_counter() - start)
+                        continue
+                    local['checkout'].append(time.perf_counter() - start)
+
+                    if rng.random() < options['cancel_rate']:
+                        start = time.perf_counter()
+                        try:
+                            cancel_order(order)
+                        except DatabaseError:
+                            local['errors'].append(time.perf_counter() - start)
+                            continue
+                        local['cancel'].append(time.perf_counter() - start)
+            finally:
+                connection.close()
+                with lock:
+                    for key, timings in local.items():
+                        stats[key].extend(timings)
+
+        threads = [threading.Thread(target=worker, args=(i, user)) for i, user in enumerate(users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats['elapsed'] = time.perf_counter() - start
+        return stats
+
+    def report(self, stats):
+        elapsed = stats['elapsed']
+        created = len(stats['checkout'])
+        self.stdout.write(
+            f"{created} orders in {elapsed:.2f}s ({created / elapsed:.1f} orders/sec), "
+            f"{len(stats['rejected'])} rejected for stock, {len(stats['cancel'])} cancelled, "
+            f"{len(stats['errors'])} database errors"
+        )
+        for label in ('checkout', 'rejected', 'cancel'):
+            timings = [t * 1000 for t in stats[label]]
+            if len(timings) < 2:
+                continue
+            cuts = statistics.quantiles(timings, n=100, method='inclusive')
+            self.stdout.write(
+                f"{label:>9}: p50={cuts[49]:.2f}ms p95={cuts[94]:.2f}ms "
+                f"p99={cuts[98]:.2f}ms max={max(timings):.2f}ms"
+            )
+
+    def check_stock(self, products, initial_stock):
+        """Remaining stock plus units held by live orders must equal the starting stock"""
+        sold = dict(
+            OrderItem.objects.filter(product__in=products)
+            .exclude(order__status='cancelled')
+            .values_list('product_id')
+            .annotate(total=Sum('quantity'))
+        )
+        problems = [
+            f'Product {product_id} shard {shard} has negative stock {stock}'
+            for product_id, shard, stock in ProductStockShard.objects.filter(
+                product__in=products, stock__lt=0
+            ).values_list('product_id', 'shard', 'stock')
+        ]
+        # Sums the shards of sharded products into Product.stock
+        rebalance([p.id for p in products])
+        for product_id, stock in Product.objects.filter(id__in=[p.id for p in products]).values_list('id', 'stock'):
+            if stock < 0:
+                problems.append(f'Product {product_id} has negative stock {stock}')
+            if stock + sold.get(product_id, 0) != initial_stock:
+                problems.append(
+                    f'Product {product_id}: stock {stock} + sold {sold.get(product_id, 0)} != {initial_stock}'
+                )
+        return problems
+
+    def cleanup(self, users, products):
+        OrderItem.objects.filter(order__user__in=users).delete()
+        Order.objects.filter(user__in=users).delete()
+        Cart.objects.filter(user__in=users).delete()
+        User.objects.filter(id__in=[u.id for u in users]).delete()
+        category_ids = {p.category_id for p in products}
+        Product.objects.filter(id__in=[p.id for p in products]).delete()
+        Category.objects.filter(id__in=category_ids).delete()
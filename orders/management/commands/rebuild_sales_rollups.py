@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from orders.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the product and daily sales rollups from paid orders'
+
+    def handle(self, *args, **options):
+        products, days = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rollups for {products} products and {days} days'))
@@ -0,0 +1,42 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_idempotency_record'),
+        ('products', '0004_product_stock_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('date', models.DateField(primary_key=True, serialize=False)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('orders_count', models.IntegerField(default=0)),
+                ('items_sold', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'daily_sales_rollups',
+                'ordering': ['date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSalesRollup',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales_rollup', serialize=False, to='products.product')),
+                ('quantity_sold', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'product_sales_rollups',
+                'indexes': [models.Index(fields=['-quantity_sold'], name='product_sal_quantit_36e1d5_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0.1 on 2026-10-18 06:10
+
+from django.db import migrations
+
+
+def backfill_sales_rollups(apps, schema_editor):
+    from orders.rollups import rebuild_rollups
+
+    rebuild_rollups(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_sales_rollups, migrations.RunPython.noop),
+    ]
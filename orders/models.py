@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from products.models import Product
 import uuid
 
@@ -42,9 +43,13 @@ class Order(models.Model):
         ]
         ordering = ['-created_at']
     
+    @staticmethod
+    def generate_order_number():
+        return f"ORD-{uuid.uuid4().hex[:12].upper()}"
+    
     def save(self, *args, **kwargs):
         if not self.order_number:
-            self.order_number = f"ORD-{uuid.uuid4().hex[:12].upper()}"
+            self.order_number = self.generate_order_number()
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -70,4 +75,103 @@ class OrderItem(models.Model):
         super().save(*args, **kwargs)
     
     def __str__(self):
-        return f"{self.product.name} x {self.quantity}"
\ No newline at end of file
+        return f"{self.product.name} x {self.quantity}"
+
+class StockReservation(models.Model):
+    """Stock held for an unpaid order until payment succeeds or the hold expires"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'stock_reservations'
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} x {self.quantity} for order {self.order_id}"
+
+
+class CheckoutTicket(models.Model):
+    """Queued checkout, processed by the Celery worker and polled by the client"""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='checkout_tickets')
+    shipping_address = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    order = models.OneToOneField(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='checkout_ticket')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'checkout_tickets'
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"Checkout {self.id} ({self.status})"
+
+
+class IdempotencyRecord(models.Model):
+    """First response to a request sent with an Idempotency-Key, replayed for retries"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_records')
+    scope = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    # Null while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'idempotency_records'
+        unique_together = ('user', 'scope', 'key')
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.scope} {self.key}"
+
+
+class ProductSalesRollup(models.Model):
+    """Running sales totals per product over paid, non-cancelled orders"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='sales_rollup')
+    quantity_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'product_sales_rollups'
+        indexes = [
+            models.Index(fields=['-quantity_sold']),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity_sold} sold"
+
+
+class DailySalesRollup(models.Model):
+    """Revenue and counts of paid, non-cancelled orders per order date"""
+    date = models.DateField(primary_key=True)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders_count = models.IntegerField(default=0)
+    items_sold = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'daily_sales_rollups'
+        ordering = ['date']
+    
+    def __str__(self):
+        return f"{self.date}: {self.revenue}"
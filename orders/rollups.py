@@ -0,0 +1,147 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.apps import apps as global_apps
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import DailySalesRollup, Order, OrderItem, ProductSalesRollup
+
+# Orders the rollups count: paid and not cancelled afterwards
+SALE_FILTER = Q(payment_status='success') & ~Q(status='cancelled')
+
+GRANULARITIES = {
+    'day': None,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def counts_as_sale(order):
+    return order.payment_status == 'success' and order.status != 'cancelled'
+
+
+def record_order_sale(order, sign=1):
+    """Add an order to the rollups, or take it out again with sign=-1"""
+    lines = list(
+        order.items.values('product_id').annotate(quantity=Sum('quantity'), revenue=Sum('subtotal')).order_by()
+    )
+    day = timezone.localdate(order.created_at)
+
+    with transaction.atomic():
+        if lines:
+            # Create missing rows, then move every product's totals in one UPDATE
+            ProductSalesRollup.objects.bulk_create(
+                [ProductSalesRollup(product_id=line['product_id']) for line in lines],
+                ignore_conflicts=True,
+            )
+            ProductSalesRollup.objects.filter(product_id__in=[line['product_id'] for line in lines]).update(
+                quantity_sold=Case(
+                    *[When(product_id=line['product_id'], then=F('quantity_sold') + Value(sign * line['quantity']))
+                      for line in lines],
+                    default=F('quantity_sold'),
+                ),
+                revenue=Case(
+                    *[When(product_id=line['product_id'], then=F('revenue') + Value(sign * line['revenue']))
+                      for line in lines],
+                    default=F('revenue'),
+                ),
+                updated_at=timezone.now(),
+            )
+
+        DailySalesRollup.objects.bulk_create([DailySalesRollup(date=day)], ignore_conflicts=True)
+        DailySalesRollup.objects.filter(date=day).update(
+            revenue=F('revenue') + Value(sign * order.total_amount),
+            orders_count=F('orders_count') + sign,
+            items_sold=F('items_sold') + sign * sum(line['quantity'] for line in lines),
+            updated_at=timezone.now(),
+        )
+
+
+def rebuild_rollups(apps=global_apps):
+    """Recompute both rollup tables from the orders, returns (product rows, day rows)
+
+    apps is the model registry, the backfill migration passes its historical one.
+    """
+    order_model = apps.get_model('orders', 'Order')
+    item_model = apps.get_model('orders', 'OrderItem')
+    product_rollup = apps.get_model('orders', 'ProductSalesRollup')
+    daily_rollup = apps.get_model('orders', 'DailySalesRollup')
+
+    sales = order_model.objects.filter(SALE_FILTER)
+    products = (
+        item_model.objects.filter(order__in=sales)
+        .values('product_id')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('subtotal'))
+        .order_by()
+    )
+    days = {
+        row['day']: row
+        for row in sales.annotate(day=TruncDate('created_at')).values('day')
+        .annotate(revenue=Sum('total_amount'), orders_count=Count('id')).order_by()
+    }
+    items_sold = dict(
+        item_model.objects.filter(order__in=sales)
+        .annotate(day=TruncDate('order__created_at')).values('day')
+        .annotate(total=Sum('quantity')).order_by()
+        .values_list('day', 'total')
+    )
+
+    with transaction.atomic():
+        product_rollup.objects.all().delete()
+        daily_rollup.objects.all().delete()
+        product_rollup.objects.bulk_create([
+            product_rollup(product_id=row['product_id'], quantity_sold=row['quantity'], revenue=row['revenue'])
+            for row in products
+        ], batch_size=1000)
+        daily_rollup.objects.bulk_create([
+            daily_rollup(
+                date=day,
+                revenue=row['revenue'],
+                orders_count=row['orders_count'],
+                items_sold=items_sold.get(day, 0),
+            )
+            for day, row in days.items()
+        ], batch_size=1000)
+    return len(products), len(days)
+
+
+def period_start(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def sales_breakdown(start_day, granularity='day'):
+    """Revenue and order counts per period from start_day through today
+
+    Closed days come from the daily rollup, only today is aggregated from the orders themselves.
+    """
+    today = timezone.localdate()
+    closed = DailySalesRollup.objects.filter(date__gte=start_day, date__lt=today, orders_count__gt=0)
+    trunc = GRANULARITIES[granularity]
+    if trunc is not None:
+        closed = closed.annotate(period=trunc('date')).values('period')
+    else:
+        closed = closed.annotate(period=F('date')).values('period')
+    closed = closed.annotate(total=Sum('revenue'), count=Sum('orders_count')).order_by('period')
+
+    buckets = defaultdict(lambda: {'total': 0, 'count': 0})
+    for row in closed:
+        buckets[row['period']] = {'total': row['total'], 'count': row['count']}
+
+    if start_day <= today:
+        midnight = timezone.make_aware(datetime.combine(today, time.min))
+        live = Order.objects.filter(SALE_FILTER, created_at__gte=midnight).aggregate(
+            total=Sum('total_amount'), count=Count('id')
+        )
+        if live['count']:
+            bucket = buckets[period_start(today, granularity)]
+            bucket['total'] += live['total']
+            bucket['count'] += live['count']
+
+    return [{'period': period, **bucket} for period, bucket in sorted(buckets.items())]
@@ -14,8 +14,18 @@ class OrderItemSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'price_at_purchase', 'subtotal')
 
 
+class CompactOrderItemSerializer(serializers.ModelSerializer):
+    """Order line with the product as an id and name, the default in order responses"""
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    
+    class Meta:
+        model = OrderItem
+        fields = ('id', 'product', 'product_name', 'quantity', 'price_at_purchase', 'subtotal')
+        read_only_fields = fields
+
+
 class OrderSerializer(serializers.ModelSerializer):
-    items = OrderItemSerializer(many=True, read_only=True)
+    items = CompactOrderItemSerializer(many=True, read_only=True)
     user_email = serializers.CharField(source='user.email', read_only=True)
     
     class Meta:
@@ -23,6 +33,13 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ('id', 'order_number', 'user_email', 'total_amount', 'status', 
                  'payment_status', 'shipping_address', 'items', 'created_at', 'updated_at')
         read_only_fields = ('id', 'order_number', 'total_amount', 'created_at', 'updated_at')
+    
+    def get_fields(self):
+        fields = super().get_fields()
+        # ?expand=product embeds the full product in every line
+        if 'product' in self.context.get('expand', ()):
+            fields['items'] = OrderItemSerializer(many=True, read_only=True)
+        return fields
 
 
 class CreateOrderSerializer(serializers.Serializer):
@@ -57,4 +74,7 @@ class OrderListSerializer(serializers.ModelSerializer):
         read_only_fields = fields
     
     def get_items_count(self, obj):
+        # List querysets annotate the count, anything else counts per order
+        if hasattr(obj, 'items_count'):
+            return obj.items_count
         return obj.items.count()
\ No newline at end of file
@@ -0,0 +1,365 @@
+import logging
+from collections import Counter, defaultdict
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.utils import timezone
+
+from carts.models import Cart, CartItem
+from carts.store import cart_owner, persist_carts
+from products.cache import bump_catalog_version
+from products.inventory import return_sharded_stock, take_sharded_stock
+from products.models import Product
+from .models import CheckoutTicket, Order, OrderItem, StockReservation
+from .rollups import counts_as_sale, record_order_sale
+
+logger = logging.getLogger(__name__)
+
+CANCELLABLE_STATUSES = ('pending', 'payment_failed')
+
+
+class CheckoutError(ValueError):
+    """Checkout rejected: empty cart or not enough stock"""
+
+
+def stock_update(quantities, sign):
+    """CASE expression moving each product's stock by sign * quantity in one UPDATE"""
+    return Case(
+        *[When(id=product_id, then=F('stock') + Value(sign * quantity)) for product_id, quantity in quantities.items()],
+        default=F('stock'),
+    )
+
+
+def begin_write():
+    """Take SQLite's database write lock at the start of a checkout transaction
+
+    SQLite ignores select_for_update, and a deferred transaction that has already read
+    cannot upgrade to a write lock while another checkout holds it: it fails at once with
+    "database is locked" instead of waiting. Writing first makes it wait on the busy timeout,
+    so concurrent checkouts queue. Other databases lock rows and need nothing here.
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {Product._meta.db_table} SET id = id WHERE 0')
+
+
+def checkout_cart(user, shipping_address):
+    """Turn the user's cart into a pending order, reserving stock in a handful of statements"""
+    persist_carts(cart_owner(user=user))
+
+    cart = Cart.objects.filter(user=user).first()
+    if cart is None:
+        raise CheckoutError('Cart is empty')
+
+    with transaction.atomic():
+        begin_write()
+        quantities = Counter()
+        for product_id, quantity in cart.items.values_list('product_id', 'quantity'):
+            quantities[product_id] += quantity
+        if not quantities:
+            raise CheckoutError('Cart is empty')
+
+        products = lock_products(quantities)
+        take_stock(products, quantities)
+
+        order = Order.objects.create(
+            user=user,
+            total_amount=sum(product.price * quantities[product.id] for product in products),
+            shipping_address=shipping_address,
+            status='pending',
+            payment_status='pending'
+        )
+        # bulk_create skips OrderItem.save(), so the subtotal is set here
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=product,
+                quantity=quantities[product.id],
+                price_at_purchase=product.price,
+                subtotal=product.price * quantities[product.id],
+            )
+            for product in products
+        ])
+        StockReservation.objects.bulk_create([
+            StockReservation(
+                order=order,
+                product=product,
+                quantity=quantities[product.id],
+                expires_at=order.created_at + timedelta(minutes=settings.STOCK_RESERVATION_TTL_MINUTES),
+            )
+            for product in products
+        ])
+        cart.items.all().delete()
+
+    # Queryset updates do not send post_save, so drop cached stock levels here
+    bump_catalog_version()
+    return order
+
+
+def enqueue_checkout(user, shipping_address):
+    """Queue a checkout for the worker and return its ticket"""
+    persist_carts(cart_owner(user=user))
+    if not CartItem.objects.filter(cart__user=user, cart__session_key=None).exists():
+        raise CheckoutError('Cart is empty')
+
+    from .tasks import process_checkouts
+    ticket = CheckoutTicket.objects.create(user=user, shipping_address=shipping_address)
+    process_checkouts.delay()
+    return ticket
+
+
+def process_checkout_queue(batch_size=None):
+    """Work through queued checkout tickets oldest first, one transaction per batch; returns tickets processed"""
+    batch_size = batch_size or settings.CHECKOUT_BATCH_SIZE
+    processed = 0
+    while True:
+        with transaction.atomic():
+            begin_write()
+            tickets = list(
+                CheckoutTicket.objects.select_for_update(skip_locked=True, of=('self',))
+                .filter(status='queued')
+                .select_related('user')
+                .order_by('created_at')[:batch_size]
+            )
+            if not tickets:
+                break
+            checkout_batch(tickets)
+        processed += len(tickets)
+        bump_catalog_version()
+    return processed
+
+
+def checkout_batch(tickets):
+    """Check out several carts together: every product row is locked and updated once for the whole batch"""
+    persist_carts(*[cart_owner(user=ticket.user) for ticket in tickets])
+
+    lines = defaultdict(Counter)
+    for user_id, product_id, quantity in CartItem.objects.filter(
+        cart__user__in=[ticket.user_id for ticket in tickets], cart__session_key=None
+    ).values_list('cart__user_id', 'product_id', 'quantity'):
+        lines[user_id][product_id] += quantity
+
+    demand = {product_id for quantities in lines.values() for product_id in quantities}
+    products = {product.id: product for product in lock_products(demand)} if demand else {}
+    available = {product.id: product.stock for product in products.values() if not product.stock_shards}
+    taken = Counter()
+    accepted = []
+    now = timezone.now()
+
+    for ticket in tickets:
+        ticket.updated_at = now
+        # A second ticket from the same user finds the cart already checked out
+        quantities = lines.pop(ticket.user_id, None)
+        if not quantities:
+            ticket.status, ticket.error = 'failed', 'Cart is empty'
+            continue
+        try:
+            for product_id, quantity in quantities.items():
+                if product_id in available and available[product_id] < quantity:
+                    product = products[product_id]
+                    raise CheckoutError(
+                        f"Insufficient stock for {product.name}. Available: {available[product_id]}, Requested: {quantity}"
+                    )
+            with transaction.atomic():
+                for product_id, quantity in quantities.items():
+                    product = products[product_id]
+                    if product.stock_shards and not take_sharded_stock(product_id, product.stock_shards, quantity):
+                        raise CheckoutError(f"Insufficient stock for {product.name}")
+        except CheckoutError as e:
+            ticket.status, ticket.error = 'failed', str(e)
+            continue
+
+        for product_id, quantity in quantities.items():
+            if product_id in available:
+                available[product_id] -= quantity
+                taken[product_id] += quantity
+        ticket.status = 'completed'
+        ticket.order = Order(
+            user=ticket.user,
+            order_number=Order.generate_order_number(),
+            total_amount=sum(products[product_id].price * quantity for product_id, quantity in quantities.items()),
+            shipping_address=ticket.shipping_address,
+            status='pending',
+            payment_status='pending'
+        )
+        accepted.append((ticket, quantities))
+
+    if taken:
+        in_stock = reduce(or_, [Q(id=product_id, stock__gte=quantity) for product_id, quantity in taken.items()])
+        if Product.objects.filter(in_stock).update(stock=stock_update(taken, -1)) != len(taken):
+            raise CheckoutError('Stock changed while the checkout batch was locked')
+
+    if accepted:
+        Order.objects.bulk_create([ticket.order for ticket, _ in accepted])
+        expires_at = now + timedelta(minutes=settings.STOCK_RESERVATION_TTL_MINUTES)
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=ticket.order,
+                product_id=product_id,
+                quantity=quantity,
+                price_at_purchase=products[product_id].price,
+                subtotal=products[product_id].price * quantity,
+            )
+            for ticket, quantities in accepted
+            for product_id, quantity in quantities.items()
+        ])
+        StockReservation.objects.bulk_create([
+            StockReservation(order=ticket.order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+            for ticket, quantities in accepted
+            for product_id, quantity in quantities.items()
+        ])
+        CartItem.objects.filter(
+            cart__user__in=[ticket.user_id for ticket, _ in accepted], cart__session_key=None
+        ).delete()
+
+    CheckoutTicket.objects.bulk_update(tickets, ['status', 'error', 'order', 'updated_at'])
+
+
+def cancel_order(order):
+    """Cancel a pending or failed order and put its stock back, False if it can no longer be cancelled"""
+    with transaction.atomic():
+        cancelled = Order.objects.filter(pk=order.pk, status__in=CANCELLABLE_STATUSES).update(
+            status='cancelled', updated_at=timezone.now()
+        )
+        if not cancelled:
+            return False
+
+        restore_stock(order.items.values_list('product_id', 'quantity', 'product__stock_shards'))
+        order.reservations.all().delete()
+
+    bump_catalog_version()
+    order.refresh_from_db(fields=['status', 'updated_at'])
+    return True
+
+
+def commit_reservations(order):
+    """Make the stock held for a paid order permanent, call inside the payment transaction"""
+    deleted, _ = order.reservations.all().delete()
+    if deleted:
+        return
+    if order.status != 'cancelled':
+        return
+
+    # The hold expired and was released before the payment came through, take the stock again
+    quantities = Counter(dict(order.items.values_list('product_id', 'quantity')))
+    try:
+        # Savepoint: a product falling short must not leave the others decremented
+        with transaction.atomic():
+            take_stock(lock_products(quantities), quantities)
+    except CheckoutError:
+        logger.warning('Order %s was paid after its stock hold expired and the stock is gone', order.order_number)
+
+
+def confirm_payment(order):
+    """Mark a locked order paid, call inside the payment transaction; False if it was already paid
+
+    Verify and the webhook both confirm the same payment, and a repeat must neither take the
+    stock again nor move a shipped or cancelled order back to paid.
+    """
+    if order.payment_status == 'success':
+        return False
+
+    counted = counts_as_sale(order)
+    commit_reservations(order)
+    order.payment_status = 'success'
+    order.status = 'paid'
+    order.save()
+    if counts_as_sale(order) and not counted:
+        record_order_sale(order)
+    return True
+
+
+def release_expired_reservations(now=None, batch_size=500):
+    """Cancel unpaid orders whose hold expired and return their stock, in batches; returns orders released"""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            begin_write()
+            order_ids = list(
+                StockReservation.objects.filter(expires_at__lte=now)
+                .values_list('order_id', flat=True)
+                .distinct()[:batch_size]
+            )
+            if not order_ids:
+                break
+
+            # Locking the orders serializes against payment verification of the same orders
+            expired = list(
+                Order.objects.select_for_update()
+                .filter(id__in=order_ids, status__in=CANCELLABLE_STATUSES)
+                .exclude(payment_status='success')
+                .values_list('id', flat=True)
+            )
+            if expired:
+                Order.objects.filter(id__in=expired).update(status='cancelled', updated_at=timezone.now())
+                restore_stock(
+                    StockReservation.objects.filter(order_id__in=expired)
+                    .values_list('product_id', 'product__stock_shards')
+                    .annotate(total=Sum('quantity'))
+                    .values_list('product_id', 'total', 'product__stock_shards')
+                )
+            StockReservation.objects.filter(order_id__in=order_ids).delete()
+        released += len(expired)
+
+    if released:
+        bump_catalog_version()
+    return released
+
+
+def lock_products(quantities):
+    """Products of an order, plain ones locked in id order so overlapping checkouts cannot deadlock"""
+    # Sharded products are not locked, their stock is taken from the shard rows
+    fields = ('id', 'name', 'price', 'stock', 'stock_shards')
+    products = list(
+        Product.objects.select_for_update()
+        .filter(id__in=quantities, stock_shards=0)
+        .order_by('id')
+        .only(*fields)
+    )
+    if len(products) < len(quantities):
+        products += Product.objects.filter(id__in=quantities, stock_shards__gt=0).order_by('id').only(*fields)
+    return products
+
+
+def take_stock(products, quantities):
+    """Decrement stock for every product with conditional updates, CheckoutError if any falls short"""
+    plain = {product.id: quantities[product.id] for product in products if not product.stock_shards}
+    for product in products:
+        if product.id in plain and product.stock < plain[product.id]:
+            raise CheckoutError(
+                f"Insufficient stock for {product.name}. Available: {product.stock}, Requested: {plain[product.id]}"
+            )
+
+    if plain:
+        # The stock__gte guard keeps the decrement safe even where row locks are not supported
+        in_stock = reduce(or_, [
+            Q(id=product_id, stock__gte=quantity) for product_id, quantity in plain.items()
+        ])
+        updated = Product.objects.filter(in_stock).update(stock=stock_update(plain, -1))
+        if updated != len(plain):
+            raise CheckoutError('Insufficient stock for one or more products')
+
+    for product in products:
+        if product.stock_shards and not take_sharded_stock(product.id, product.stock_shards, quantities[product.id]):
+            raise CheckoutError(f"Insufficient stock for {product.name}")
+
+
+def restore_stock(rows):
+    """Put back stock from (product_id, quantity, stock_shards) rows"""
+    quantities = Counter()
+    shards = {}
+    for product_id, quantity, stock_shards in rows:
+        quantities[product_id] += quantity
+        if stock_shards:
+            shards[product_id] = stock_shards
+
+    plain = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in shards}
+    if plain:
+        Product.objects.filter(id__in=plain).update(stock=stock_update(plain, 1))
+    for product_id, stock_shards in shards.items():
+        return_sharded_stock(product_id, stock_shards, quantities[product_id])
@@ -0,0 +1,22 @@
+from celery import shared_task
+
+from .idempotency import purge_expired_records
+from .services import process_checkout_queue, release_expired_reservations
+
+
+@shared_task
+def process_checkouts():
+    """Drain the checkout queue"""
+    return process_checkout_queue()
+
+
+@shared_task
+def release_expired_stock():
+    """Periodic sweep of expired stock holds, schedule it with Celery beat"""
+    return release_expired_reservations()
+
+
+@shared_task
+def purge_idempotency_records():
+    """Periodic cleanup of Idempotency-Key responses past their replay window"""
+    return purge_expired_records()
@@ -1,24 +1,64 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.db import transaction
-from django.db.models import Sum, Count
+from django.db.models import Count, Prefetch, prefetch_related_objects
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Order, OrderItem
+from ecommerce_backend.pagination import CursorPaginationMixin
+from .export import OUTPUTS, ExportError, export_lines, parse_day
+from .idempotency import idempotent
+from .models import CheckoutTicket, Order, OrderItem
+from .rollups import GRANULARITIES, counts_as_sale, record_order_sale, sales_breakdown
 from .serializers import OrderSerializer, CreateOrderSerializer, OrderListSerializer
-from carts.models import Cart
-from products.models import Product
+from .services import CheckoutError, cancel_order, checkout_cart, enqueue_checkout
 from accounts.models import Address
 
 
-class OrderViewSet(viewsets.ReadOnlyModelViewSet):
+# Columns the compact order lines render
+COMPACT_ITEM_FIELDS = ('id', 'order_id', 'product_id', 'quantity', 'price_at_purchase', 'subtotal', 'product__name')
+
+
+def order_items_prefetch(expand=()):
+    """Order items loaded with exactly what OrderSerializer renders for the given expansions"""
+    if 'product' in expand:
+        items = OrderItem.objects.select_related('product__category')
+    else:
+        items = OrderItem.objects.select_related('product').only(*COMPACT_ITEM_FIELDS)
+    return Prefetch('items', queryset=items.order_by('id'))
+
+
+class OrderViewSet(CursorPaginationMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Order.objects.all().prefetch_related('items__product')
-        return Order.objects.filter(user=self.request.user).prefetch_related('items__product')
+            queryset = Order.objects.all()
+        else:
+            queryset = Order.objects.filter(user=self.request.user)
+        
+        if self.action == 'list':
+            # The list shows a count only, no items or products. Meta.ordering
+            # is not applied to aggregate queries, so order explicitly.
+            return queryset.annotate(items_count=Count('items')).order_by('-created_at')
+        return queryset.select_related('user').prefetch_related(order_items_prefetch(self.get_expand()))
+    
+    def get_expand(self):
+        return set(filter(None, self.request.query_params.get('expand', '').split(',')))
+    
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand'] = self.get_expand()
+        return context
+    
+    def serialize_order(self, order):
+        """Serialize one order, loading its items if the queryset did not"""
+        if 'items' not in getattr(order, '_prefetched_objects_cache', {}):
+            prefetch_related_objects([order], order_items_prefetch(self.get_expand()))
+        return OrderSerializer(order, context=self.get_serializer_context()).data
     
     def get_serializer_class(self):
         if self.action == 'list':
@@ -26,25 +66,12 @@ class OrderViewSet(viewsets.ReadOnlyModelViewSet):
         return OrderSerializer
     
     @action(detail=False, methods=['post'])
+    @idempotent('orders.create_order')
     def create_order(self, request):
         """Create order from cart"""
         serializer = CreateOrderSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         
-        try:
-            cart = Cart.objects.get(user=request.user)
-        except Cart.DoesNotExist:
-            return Response(
-                {'error': 'Cart is empty'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        if not cart.items.exists():
-            return Response(
-                {'error': 'Cart is empty'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
         shipping_address_id = serializer.validated_data.get('shipping_address_id')
         shipping_address_text = serializer.validated_data.get('shipping_address')
         
@@ -54,48 +81,22 @@ class OrderViewSet(viewsets.ReadOnlyModelViewSet):
         else:
             shipping_address = shipping_address_text
         
-        try:
-            with transaction.atomic():
-                total_amount = 0
-                cart_items = cart.items.select_related('product').select_for_update()
-                
-                for cart_item in cart_items:
-                    product = cart_item.product
-                    
-                    if product.stock < cart_item.quantity:
-                        raise ValueError(
-                            f"Insufficient stock for {product.name}. Available: {product.stock}, Requested: {cart_item.quantity}"
-                        )
-                    
-                    total_amount += product.price * cart_item.quantity
-                
-                order = Order.objects.create(
-                    user=request.user,
-                    total_amount=total_amount,
-                    shipping_address=shipping_address,
-                    status='pending',
-                    payment_status='pending'
+        if settings.CHECKOUT_MODE == 'async':
+            try:
+                ticket = enqueue_checkout(request.user, shipping_address)
+            except CheckoutError as e:
+                return Response(
+                    {'error': str(e)},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-                
-                for cart_item in cart_items:
-                    product = cart_item.product
-                    
-                    OrderItem.objects.create(
-                        order=order,
-                        product=product,
-                        quantity=cart_item.quantity,
-                        price_at_purchase=product.price
-                    )
-                    
-                    product.stock -= cart_item.quantity
-                    product.save()
-                
-                cart.items.all().delete()
-                
-                order_serializer = OrderSerializer(order)
-                return Response(order_serializer.data, status=status.HTTP_201_CREATED)
-        
-        except ValueError as e:
+            return Response(
+                self.serialize_ticket(ticket, request),
+                status=status.HTTP_202_ACCEPTED
+            )
+        
+        try:
+            order = checkout_cart(request.user, shipping_address)
+        except CheckoutError as e:
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_400_BAD_REQUEST
@@ -105,29 +106,43 @@ class OrderViewSet(viewsets.ReadOnlyModelViewSet):
                 {'error': f'Failed to create order: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+        
+        return Response(self.serialize_order(order), status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get'], url_path='checkout-status/(?P<ticket>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})')
+    def checkout_status(self, request, ticket=None):
+        """Poll a queued checkout"""
+        ticket = get_object_or_404(
+            CheckoutTicket.objects.select_related('order__user'),
+            id=ticket,
+            user=request.user
+        )
+        return Response(self.serialize_ticket(ticket, request))
+    
+    def serialize_ticket(self, ticket, request):
+        data = {
+            'ticket': str(ticket.id),
+            'status': ticket.status,
+            'status_url': reverse('order-checkout-status', kwargs={'ticket': ticket.id}, request=request),
+        }
+        if ticket.status == 'completed':
+            data['order'] = self.serialize_order(ticket.order)
+        elif ticket.status == 'failed':
+            data['error'] = ticket.error
+        return data
     
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         """Cancel order and restore stock"""
         order = self.get_object()
         
-        if order.status not in ['pending', 'payment_failed']:
+        if not cancel_order(order):
             return Response(
                 {'error': 'Only pending or failed orders can be cancelled'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        with transaction.atomic():
-            for order_item in order.items.select_for_update():
-                product = order_item.product
-                product.stock += order_item.quantity
-                product.save()
-            
-            order.status = 'cancelled'
-            order.save()
-        
-        serializer = OrderSerializer(order)
-        return Response(serializer.data)
+        return Response(self.serialize_order(order))
     
     @action(detail=True, methods=['patch'], permission_classes=[IsAdminUser])
     def update_status(self, request, pk=None):
@@ -148,36 +163,68 @@ class OrderViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        order.status = new_status
-        order.save()
+        with transaction.atomic():
+            was_sale = counts_as_sale(order)
+            order.status = new_status
+            order.save()
+            
+            # Cancelling a paid order takes it out of the sales rollups, reinstating it puts it back
+            if counts_as_sale(order) != was_sale:
+                record_order_sale(order, sign=-1 if was_sale else 1)
+        
+        return Response(self.serialize_order(order))
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        """Stream every order or order line as CSV or JSON Lines (admin only)"""
+        kind = request.query_params.get('export', 'orders')
+        # Not ?format=, DRF reserves that for renderer selection
+        output = request.query_params.get('output', 'csv')
+        try:
+            lines = export_lines(
+                kind,
+                output,
+                start=parse_day(request.query_params.get('start')),
+                end=parse_day(request.query_params.get('end')),
+            )
+        except ExportError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        serializer = OrderSerializer(order)
-        return Response(serializer.data)
+        response = StreamingHttpResponse(lines, content_type=OUTPUTS[output])
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{output}"'
+        return response
     
     @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
     def sales_report(self, request):
-        """Sales report with date filtering"""
+        """Sales report with date filtering, bucketed by day, week or month"""
         from django.utils import timezone
         from datetime import timedelta
         
-        days = int(request.query_params.get('days', 30))
-        start_date = timezone.now() - timedelta(days=days)
-        
-        orders = Order.objects.filter(
-            created_at__gte=start_date,
-            payment_status='success'
-        )
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            return Response(
+                {'error': 'days must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        granularity = request.query_params.get('granularity', 'day')
+        if granularity not in GRANULARITIES:
+            return Response(
+                {'error': f'Invalid granularity. Valid options: {list(GRANULARITIES)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        daily_sales = orders.extra(
-            select={'day': 'date(created_at)'}
-        ).values('day').annotate(
-            total=Sum('total_amount'),
-            count=Count('id')
-        ).order_by('day')
+        # Closed days come from the rollup table, only today is aggregated from orders
+        breakdown = sales_breakdown(timezone.localdate() - timedelta(days=days), granularity)
+        label = {'day': 'daily', 'week': 'weekly', 'month': 'monthly'}[granularity]
         
         return Response({
             'period_days': days,
-            'total_orders': orders.count(),
-            'total_revenue': orders.aggregate(Sum('total_amount'))['total_amount__sum'] or 0,
-            'daily_breakdown': list(daily_sales)
+            'granularity': granularity,
+            'total_orders': sum(row['count'] for row in breakdown),
+            'total_revenue': sum(row['total'] for row in breakdown),
+            f'{label}_breakdown': [
+                {granularity: row['period'], 'total': row['total'], 'count': row['count']}
+                for row in breakdown
+            ]
         })
\ No newline at end of file
@@ -15,7 +15,9 @@ from .serializers import (
     PaymentVerifySerializer,
     PaymentSerializer
 )
+from orders.idempotency import idempotent
 from orders.models import Order
+from orders.services import confirm_payment
 
 
 class PaymentViewSet(viewsets.GenericViewSet):
@@ -29,6 +31,7 @@ class PaymentViewSet(viewsets.GenericViewSet):
         )
     
     @action(detail=False, methods=['post'])
+    @idempotent('payments.initiate')
     def initiate(self, request):
         """Initiate payment with Razorpay"""
         serializer = PaymentInitiateSerializer(
@@ -83,6 +86,7 @@ class PaymentViewSet(viewsets.GenericViewSet):
             )
     
     @action(detail=False, methods=['post'])
+    @idempotent('payments.verify')
     def verify(self, request):
         """Verify payment signature"""
         serializer = PaymentVerifySerializer(data=request.data)
@@ -114,16 +118,20 @@ class PaymentViewSet(viewsets.GenericViewSet):
                 )
                 payment = Payment.objects.select_for_update().get(order=order)
                 
+                if order.status == 'cancelled' and order.payment_status == 'success':
+                    return Response(
+                        {'error': 'Order was cancelled after payment'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                
                 # Update payment
                 payment.razorpay_payment_id = razorpay_payment_id
                 payment.razorpay_signature = razorpay_signature
                 payment.status = 'success'
                 payment.save()
                 
-                # Update order
-                order.payment_status = 'success'
-                order.status = 'paid'
-                order.save()
+                # Update order, a repeated verify leaves an already paid order as it is
+                confirm_payment(order)
                 
                 return Response({
                     'message': 'Payment verified successfully',
@@ -182,10 +190,8 @@ class PaymentViewSet(viewsets.GenericViewSet):
                     payment.gateway_response = str(webhook_body)
                     payment.save()
                     
-                    order = payment.order
-                    order.payment_status = 'success'
-                    order.status = 'paid'
-                    order.save()
+                    order = Order.objects.select_for_update().get(pk=payment.order_id)
+                    confirm_payment(order)
             
             except Payment.DoesNotExist:
                 pass
@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def create_search_index(sender, using='default', **kwargs):
+    from .search import ensure_search_index
+    ensure_search_index(using)
 
 
 class ProductsConfig(AppConfig):
     name = 'products'
+    
+    def ready(self):
+        from . import signals  # noqa: F401
+        post_migrate.connect(create_search_index, sender=self)
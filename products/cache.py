@@ -0,0 +1,53 @@
+import hashlib
+
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = 'catalog:version'
+SUGGESTION_VERSION_KEY = 'catalog:suggestion_version'
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_version(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Key missing (first write or evicted), start a new version sequence
+        get_version(key)
+        return cache.incr(key)
+
+
+def get_catalog_version():
+    """Current catalog version, bumped whenever products or categories change"""
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    """Invalidate every cached catalog response at once"""
+    return bump_version(CATALOG_VERSION_KEY)
+
+
+def get_suggestion_version():
+    """Version of product and category names, bumped on saves but not stock updates"""
+    return get_version(SUGGESTION_VERSION_KEY)
+
+
+def bump_suggestion_version():
+    return bump_version(SUGGESTION_VERSION_KEY)
+
+
+def catalog_cache_key(prefix, query_params, allowed_params):
+    """Build a versioned cache key from the normalized query params"""
+    normalized = []
+    for name in sorted(allowed_params):
+        value = query_params.get(name, '').strip()
+        if value:
+            normalized.append(f"{name}={value}")
+    digest = hashlib.md5('&'.join(normalized).encode()).hexdigest()
+    return f"{prefix}:v{get_catalog_version()}:{digest}"
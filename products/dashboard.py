@@ -0,0 +1,133 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, F, Q, Sum
+
+from .inventory import available_stock
+from .models import Category, Product
+
+DASHBOARD_CACHE_KEY = 'analytics:dashboard'
+REFRESH_LOCK_KEY = 'analytics:dashboard:refreshing'
+
+
+def order_summary():
+    """Order counts for every status in one pass over the orders table"""
+    from orders.models import Order
+
+    counts = Order.objects.aggregate(**{
+        status: Count('id', filter=Q(status=status)) for status, _ in Order.STATUS_CHOICES
+    })
+    return {
+        'orders_by_status': [
+            {'status': status, 'count': count} for status, count in sorted(counts.items()) if count
+        ],
+    }
+
+
+def catalog_summary():
+    """Product and category totals in one query, products always belong to a category"""
+    return Category.objects.aggregate(
+        total_categories=Count('id', distinct=True),
+        total_products=Count('products', distinct=True),
+    )
+
+
+def sales_summary():
+    from orders.models import DailySalesRollup, ProductSalesRollup
+
+    total_revenue = DailySalesRollup.objects.aggregate(total=Sum('revenue'))['total'] or 0
+    top_products = ProductSalesRollup.objects.filter(quantity_sold__gt=0).values(
+        'product__name', 'product__id', 'revenue', total_sold=F('quantity_sold')
+    ).order_by('-quantity_sold')[:10]
+    return {
+        'total_revenue': float(total_revenue),
+        'top_products': list(top_products),
+    }
+
+
+def low_stock_summary():
+    low_stock = Product.objects.annotate(available_stock=available_stock()).filter(
+        available_stock__lt=10,
+        is_active=True
+    ).values('id', 'name', 'available_stock', 'category__name')
+    return {'low_stock_products': [
+        {'id': row['id'], 'name': row['name'], 'stock': row['available_stock'], 'category__name': row['category__name']}
+        for row in low_stock
+    ]}
+
+
+def recent_orders_summary():
+    from orders.models import Order
+    from orders.serializers import OrderListSerializer
+
+    recent_orders = Order.objects.annotate(items_count=Count('items')).order_by('-created_at')[:10]
+    return {'recent_orders': OrderListSerializer(recent_orders, many=True).data}
+
+
+SECTIONS = (order_summary, catalog_summary, sales_summary, low_stock_summary, recent_orders_summary)
+
+
+def run_section(section):
+    try:
+        return section()
+    finally:
+        # Pool threads open their own connections, don't leave them behind
+        connection.close()
+
+
+def build_dashboard():
+    """Compute every dashboard section, in parallel where each one can use its own connection"""
+    workers = settings.ANALYTICS_DASHBOARD_WORKERS
+    data = {}
+    if workers > 1 and not connection.in_atomic_block:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(run_section, SECTIONS):
+                data.update(result)
+    else:
+        # Threads would not see rows written by an open transaction, stay on this connection
+        for section in SECTIONS:
+            data.update(section())
+    return data
+
+
+def refresh_dashboard():
+    data = build_dashboard()
+    cache.set(
+        DASHBOARD_CACHE_KEY,
+        {'data': data, 'built_at': time.time()},
+        timeout=settings.ANALYTICS_CACHE_TTL + settings.ANALYTICS_STALE_TTL,
+    )
+    return data
+
+
+def refresh_in_background():
+    def refresh():
+        try:
+            refresh_dashboard()
+        finally:
+            cache.delete(REFRESH_LOCK_KEY)
+            connection.close()
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def get_dashboard():
+    """Dashboard data from the cache, stale entries are served while one request rebuilds them"""
+    cached = cache.get(DASHBOARD_CACHE_KEY)
+    if cached is None:
+        return refresh_dashboard()
+
+    if time.time() - cached['built_at'] > settings.ANALYTICS_CACHE_TTL:
+        # Only the request that takes the lock rebuilds, everyone else keeps getting the stale copy
+        if cache.add(REFRESH_LOCK_KEY, True, timeout=60):
+            if connection.in_atomic_block:
+                try:
+                    return refresh_dashboard()
+                finally:
+                    cache.delete(REFRESH_LOCK_KEY)
+            refresh_in_background()
+    return cached['data']
@@ -0,0 +1,60 @@
+from decimal import Decimal
+
+from django.db.models import Count, Q
+
+from .inventory import available_stock
+
+# Lower bounds of the price histogram buckets, the last bucket is open ended
+PRICE_BUCKETS = [Decimal(edge) for edge in ('0', '500', '1000', '5000', '10000', '50000')]
+
+FACETS = ('category', 'price', 'in_stock')
+
+
+def price_ranges():
+    uppers = PRICE_BUCKETS[1:] + [None]
+    return list(zip(PRICE_BUCKETS, uppers))
+
+
+def compute_facets(queryset, requested):
+    """Compute the requested facets for a filtered product queryset in one query"""
+    requested = [facet for facet in FACETS if facet in requested]
+    if not requested:
+        return {}
+    
+    aggregates = {'count': Count('id')}
+    if 'in_stock' in requested:
+        queryset = queryset.alias(available_stock=available_stock())
+        aggregates['in_stock'] = Count('id', filter=Q(available_stock__gt=0))
+    if 'price' in requested:
+        for i, (low, high) in enumerate(price_ranges()):
+            condition = Q(price__gte=low)
+            if high is not None:
+                condition &= Q(price__lt=high)
+            aggregates[f'price_{i}'] = Count('id', filter=condition)
+    
+    queryset = queryset.order_by()
+    if 'category' in requested:
+        # Group by category and fold the other facets from the per-category rows
+        rows = list(queryset.values('category_id', 'category__name', 'category__slug').annotate(**aggregates))
+    else:
+        rows = [queryset.aggregate(**aggregates)]
+    
+    facets = {}
+    if 'category' in requested:
+        facets['category'] = [
+            {'id': row['category_id'], 'name': row['category__name'],
+             'slug': row['category__slug'], 'count': row['count']}
+            for row in sorted(rows, key=lambda row: (-row['count'], row['category__name']))
+        ]
+    if 'price' in requested:
+        facets['price'] = [
+            {'min': low, 'max': high, 'count': sum(row[f'price_{i}'] for row in rows)}
+            for i, (low, high) in enumerate(price_ranges())
+        ]
+    if 'in_stock' in requested:
+        in_stock = sum(row['in_stock'] for row in rows)
+        facets['in_stock'] = {
+            'in_stock': in_stock,
+            'out_of_stock': sum(row['count'] for row in rows) - in_stock,
+        }
+    return facets
@@ -0,0 +1,17 @@
+from rest_framework import filters
+from rest_framework.settings import api_settings
+from .search import search_products
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """Full-text product search ranked by relevance unless an ordering is requested"""
+    
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '')
+        if not text.strip():
+            return queryset
+        
+        queryset = search_products(queryset, text)
+        if 'search_rank' in queryset.query.annotations and not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by('-search_rank', '-id')
+        return queryset
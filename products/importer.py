@@ -0,0 +1,209 @@
+import csv
+import json
+import time
+from collections import Counter, defaultdict
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .cache import bump_catalog_version, bump_suggestion_version
+from .inventory import MAX_PRICE, MAX_STOCK
+from .models import Category, Product
+
+INPUTS = ('csv', 'jsonl')
+# Columns an import always sets; the optional ones only when the row has a value for them,
+# so a feed without them leaves existing products alone. Anything else in a row is ignored.
+UPDATE_FIELDS = ['slug', 'name', 'category', 'price', 'updated_at']
+OPTIONAL_FIELDS = ('stock', 'description', 'image_url', 'is_active')
+# Row errors kept for the report, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+SLUG_LENGTH = Product._meta.get_field('slug').max_length
+URL_LENGTH = Product._meta.get_field('image_url').max_length
+
+
+class FeedError(ValueError):
+    """Unreadable feed or unknown input type"""
+
+
+class RowError(ValueError):
+    """One feed row that cannot be imported"""
+
+
+def read_rows(stream, input_type):
+    """Feed rows as dicts from a text stream, read lazily"""
+    if input_type == 'csv':
+        return csv.DictReader(stream)
+    if input_type == 'jsonl':
+        return (json.loads(line) for line in stream if line.strip())
+    raise FeedError(f'Invalid input. Valid options: {list(INPUTS)}')
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def present_fields(row):
+    return tuple(field for field in OPTIONAL_FIELDS if row.get(field) not in (None, ''))
+
+
+def parse_bool(value, default=True):
+    if value in (None, ''):
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+class ProductImporter:
+    """Upsert products from feed rows, keyed on slug, in one transaction per chunk
+
+    Rows without a slug get slugify(name); repeated names in one feed get -2, -3... in feed
+    order, so re-importing the same feed updates the same products. Numbering skips slugs that
+    earlier rows gave explicitly, and a row giving a slug an earlier row was numbered to fails.
+    """
+
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        # One query for every category, looked up by slug or by slugified name
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self.slug_counts = Counter()
+        self.explicit_slugs = set()
+        self.generated_slugs = set()
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def run(self, rows):
+        start = time.perf_counter()
+        try:
+            for chunk in chunked(rows, self.chunk_size):
+                self.import_chunk(chunk)
+        except (csv.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise FeedError(f'Unreadable feed after row {self.rows}: {e}')
+        finally:
+            if self.imported:
+                # bulk_create skips post_save, drop cached pages and suggestions once per import
+                bump_catalog_version()
+                bump_suggestion_version()
+        elapsed = time.perf_counter() - start
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors,
+            'seconds': round(elapsed, 2),
+            'rows_per_second': round(self.rows / elapsed) if elapsed else self.rows,
+        }
+
+    def import_chunk(self, chunk):
+        products = {}
+        now = timezone.now()
+        for row in chunk:
+            self.rows += 1
+            try:
+                product = self.build(row, now)
+            except RowError as e:
+                self.fail(self.rows, str(e))
+                continue
+            # A later row for the same slug wins
+            products[product.slug] = (self.rows, product, present_fields(row))
+        if not products:
+            return
+
+        with transaction.atomic():
+            # Overwriting stock would desync shard counters, those products must be unsharded first
+            sharded = Product.objects.filter(slug__in=products, stock_shards__gt=0).values_list('slug', flat=True)
+            for slug in sharded:
+                line, product, fields = products[slug]
+                if 'stock' in fields:
+                    del products[slug]
+                    self.fail(line, f'Product {slug} has sharded stock, disable sharding before importing it')
+
+            # One upsert per set of columns, usually just one for the whole chunk
+            groups = defaultdict(list)
+            for _, product, fields in products.values():
+                groups[fields].append(product)
+            for fields, group in groups.items():
+                Product.objects.bulk_create(
+                    group,
+                    update_conflicts=True,
+                    unique_fields=['slug'],
+                    update_fields=UPDATE_FIELDS + list(fields),
+                )
+        self.imported += len(products)
+
+    def build(self, row, now):
+        if not isinstance(row, dict):
+            raise RowError('Row is not an object')
+        name = str(row.get('name') or '').strip()
+        if not name:
+            raise RowError('name is required')
+
+        category = str(row.get('category') or '').strip()
+        category_id = self.categories.get(category) or self.categories.get(slugify(category))
+        if category_id is None:
+            raise RowError(f'Unknown category {category!r}')
+
+        try:
+            price = Decimal(str(row.get('price')))
+        except (InvalidOperation, ValueError):
+            raise RowError(f"Invalid price {row.get('price')!r}")
+        if not price.is_finite() or price >= MAX_PRICE:
+            raise RowError(f"Invalid price {row.get('price')!r}")
+        price = price.quantize(Decimal('0.01'))
+        if price <= 0:
+            raise RowError('price must be greater than 0')
+
+        try:
+            stock = int(row.get('stock') or 0)
+        except (TypeError, ValueError):
+            raise RowError(f"Invalid stock {row.get('stock')!r}")
+        if stock < 0:
+            raise RowError('stock cannot be negative')
+        if stock > MAX_STOCK:
+            raise RowError(f'stock cannot be above {MAX_STOCK}')
+
+        image_url = row.get('image_url') or None
+        if image_url and len(image_url) > URL_LENGTH:
+            raise RowError('image_url is too long')
+
+        return Product(
+            slug=self.slug_for(row, name),
+            category_id=category_id,
+            name=name[:255],
+            description=row.get('description') or None,
+            price=price,
+            stock=stock,
+            image_url=image_url,
+            is_active=parse_bool(row.get('is_active')),
+            updated_at=now,
+        )
+
+    def slug_for(self, row, name):
+        slug = slugify(row.get('slug') or '')[:SLUG_LENGTH]
+        if slug:
+            if slug in self.generated_slugs:
+                raise RowError(f'Slug {slug} was already given to an earlier row without a slug')
+            self.explicit_slugs.add(slug)
+            return slug
+        base = slugify(name)[:SLUG_LENGTH - 8]
+        if not base:
+            raise RowError(f'Cannot build a slug from name {name!r}')
+        while True:
+            self.slug_counts[base] += 1
+            count = self.slug_counts[base]
+            slug = base if count == 1 else f'{base}-{count}'
+            if slug not in self.explicit_slugs:
+                self.generated_slugs.add(slug)
+                return slug
+
+    def fail(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': line, 'error': message})
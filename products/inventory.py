@@ -0,0 +1,203 @@
+import random
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .models import Product, ProductStockShard
+
+# Stock is an IntegerField, 32 bits on every supported database
+MAX_STOCK = 2 ** 31 - 1
+PRICE_FIELD = Product._meta.get_field('price')
+MAX_PRICE = Decimal(10) ** (PRICE_FIELD.max_digits - PRICE_FIELD.decimal_places)
+
+
+def split_stock(total, shards):
+    """Spread total as evenly as possible over the given number of shards"""
+    base, extra = divmod(total, shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+
+def enable_sharding(product_id, shards):
+    """Move a product's stock from its row into shard rows"""
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(id=product_id)
+        total = sharded_total(product) if product.stock_shards else product.stock
+        ProductStockShard.objects.filter(product=product).delete()
+        ProductStockShard.objects.bulk_create([
+            ProductStockShard(product=product, shard=i, stock=stock)
+            for i, stock in enumerate(split_stock(total, shards))
+        ])
+        Product.objects.filter(id=product.id).update(stock=total, stock_shards=shards)
+    bump_catalog_version()
+
+
+def disable_sharding(product_id):
+    """Fold the shard rows back into the product row"""
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(id=product_id)
+        if not product.stock_shards:
+            return
+        total = sharded_total(product)
+        ProductStockShard.objects.filter(product=product).delete()
+        Product.objects.filter(id=product.id).update(stock=total, stock_shards=0)
+    bump_catalog_version()
+
+
+def sharded_total(product):
+    return ProductStockShard.objects.filter(product=product).aggregate(total=Sum('stock'))['total'] or 0
+
+
+def stock_level(product):
+    """Sellable stock of a product, Product.stock of a sharded one is only a copy made by rebalance"""
+    return sharded_total(product) if product.stock_shards else product.stock
+
+
+def available_stock(prefix=''):
+    """stock_level as a query expression, for filtering and annotating product querysets
+
+    prefix reaches the product through a relation from other models, e.g. 'product__' on cart items.
+    """
+    shards = ProductStockShard.objects.filter(product=OuterRef(f'{prefix}pk')).values('product').annotate(
+        total=Sum('stock')
+    ).values('total')
+    return Case(
+        When(**{f'{prefix}stock_shards__gt': 0}, then=Coalesce(Subquery(shards), 0)),
+        default=F(f'{prefix}stock'),
+        output_field=IntegerField(),
+    )
+
+
+def rebalance(product_ids=None):
+    """Even out the shards of sharded products and copy their totals to Product.stock for display"""
+    products = Product.objects.filter(stock_shards__gt=0)
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+
+    totals = {}
+    for product_id in products.order_by('id').values_list('id', flat=True):
+        with transaction.atomic():
+            rows = list(ProductStockShard.objects.select_for_update().filter(product_id=product_id).order_by('shard'))
+            total = sum(row.stock for row in rows)
+            for row, stock in zip(rows, split_stock(total, len(rows))):
+                row.stock = stock
+            ProductStockShard.objects.bulk_update(rows, ['stock'])
+            Product.objects.filter(id=product_id).update(stock=total)
+        totals[product_id] = total
+
+    if totals:
+        bump_catalog_version()
+    return totals
+
+
+def take_sharded_stock(product_id, shards, quantity):
+    """Decrement one product's stock from its shards, False if the shards together hold too little"""
+    order = list(range(shards))
+    random.shuffle(order)
+    for shard in order:
+        taken = ProductStockShard.objects.filter(
+            product_id=product_id, shard=shard, stock__gte=quantity
+        ).update(stock=F('stock') - quantity)
+        if taken:
+            return True
+
+    # No single shard holds enough, drain several of them under lock
+    rows = list(ProductStockShard.objects.select_for_update().filter(product_id=product_id).order_by('shard'))
+    if sum(row.stock for row in rows) < quantity:
+        return False
+    remaining = quantity
+    for row in rows:
+        taken = min(row.stock, remaining)
+        row.stock -= taken
+        remaining -= taken
+    ProductStockShard.objects.bulk_update(rows, ['stock'])
+    return True
+
+
+def return_sharded_stock(product_id, shards, quantity):
+    """Put stock back on a random shard"""
+    ProductStockShard.objects.filter(
+        product_id=product_id, shard=random.randrange(shards)
+    ).update(stock=F('stock') + quantity)
+
+
+def grouped_case(field, values):
+    """CASE setting field from {id: value}, with one WHEN per distinct value rather than per row"""
+    ids_by_value = defaultdict(list)
+    for product_id, value in values.items():
+        ids_by_value[value].append(product_id)
+    return Case(
+        *[When(id__in=ids, then=Value(value)) for value, ids in ids_by_value.items()],
+        default=F(field),
+        output_field=Product._meta.get_field(field),
+    )
+
+
+def apply_stock_price_updates(updates, mode='set', chunk_size=5000):
+    """Apply a batch of {id, stock, price} changes in one transaction, all or nothing
+
+    Returns (changed ids, missing ids, errors by position in updates); nothing is written when
+    there are errors. Unknown ids are skipped rather than failing the batch.
+    """
+    with transaction.atomic():
+        products = Product.objects.select_for_update().only(
+            'id', 'stock', 'price', 'stock_shards'
+        ).in_bulk([update['id'] for update in updates])
+
+        stocks = {}
+        prices = {}
+        missing = []
+        errors = {}
+        for index, update in enumerate(updates):
+            product = products.get(update['id'])
+            if product is None:
+                missing.append(update['id'])
+                continue
+            if 'stock' in update:
+                if product.stock_shards:
+                    errors[index] = 'Stock is sharded, disable sharding before syncing it'
+                    continue
+                stock = product.stock + update['stock'] if mode == 'adjust' else update['stock']
+                if stock < 0:
+                    errors[index] = f'Stock cannot go below 0, currently {product.stock}'
+                    continue
+                if stock > MAX_STOCK:
+                    errors[index] = f'Stock cannot go above {MAX_STOCK}, currently {product.stock}'
+                    continue
+                if stock != product.stock:
+                    stocks[product.id] = stock
+            if 'price' in update:
+                price = product.price + update['price'] if mode == 'adjust' else update['price']
+                if price <= 0:
+                    errors[index] = 'Price must be greater than 0'
+                    continue
+                if price >= MAX_PRICE:
+                    errors[index] = f'Price must be below {MAX_PRICE}, currently {product.price}'
+                    continue
+                if price != product.price:
+                    prices[product.id] = price
+
+        if errors:
+            return [], missing, errors
+
+        # Stock levels and prices repeat a lot, so grouping ids by value keeps each CASE short
+        changed = sorted(stocks.keys() | prices.keys())
+        now = timezone.now()
+        for i in range(0, len(changed), chunk_size):
+            chunk = changed[i:i + chunk_size]
+            fields = {'updated_at': now}
+            chunk_stocks = {product_id: stocks[product_id] for product_id in chunk if product_id in stocks}
+            chunk_prices = {product_id: prices[product_id] for product_id in chunk if product_id in prices}
+            if chunk_stocks:
+                fields['stock'] = grouped_case('stock', chunk_stocks)
+            if chunk_prices:
+                fields['price'] = grouped_case('price', chunk_prices)
+            Product.objects.filter(id__in=chunk).update(**fields)
+
+    if changed:
+        bump_catalog_version()
+    return changed, missing, errors
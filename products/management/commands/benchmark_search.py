@@ -0,0 +1,105 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from products.models import Category, Product
+from products.search import search_backend, search_products
+
+SYLLABLES = ['ka', 'lo', 'mi', 'tor', 'ven', 'sa', 'ri', 'pex', 'dan', 'qu', 'el', 'bra', 'zon', 'fi', 'net']
+
+
+def build_vocabulary(rng, size):
+    """Pseudo words so term frequencies resemble a real catalog vocabulary"""
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark full-text product search against LIKE search on synthetic products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--vocabulary', type=int, default=5_000)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic products')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Search backend: {search_backend() or 'LIKE fallback'}")
+        self.words = build_vocabulary(random.Random(1), options['vocabulary'])
+        try:
+            with transaction.atomic():
+                self.seed(options['products'], options['batch_size'])
+                self.run_queries(options['queries'])
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write('Synthetic products rolled back')
+
+    def seed(self, count, batch_size):
+        category, _ = Category.objects.get_or_create(name='Search Benchmark')
+        rng = random.Random(42)
+        start = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            batch = []
+            for i in range(offset, min(offset + batch_size, count)):
+                name = ' '.join(rng.sample(self.words, 3))
+                batch.append(Product(
+                    category=category,
+                    name=name,
+                    slug=f'search-benchmark-{i}',
+                    description=' '.join(rng.sample(self.words, 8)),
+                    price=rng.randint(1, 5000),
+                    stock=rng.randint(0, 100),
+                ))
+            Product.objects.bulk_create(batch)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"Seeded {count} products in {elapsed:.1f}s")
+
+    def run_queries(self, count):
+        rng = random.Random(7)
+        # Whole words, two-word queries and three-letter type-ahead prefixes
+        queries = {'word': [], 'phrase': [], 'prefix': []}
+        for _ in range(count):
+            words = rng.sample(self.words, 2)
+            queries['word'].append(words[0])
+            queries['phrase'].append(' '.join(words))
+            queries['prefix'].append(words[0][:3])
+
+        base = Product.objects.filter(is_active=True)
+
+        def full_text(term):
+            qs = search_products(base, term).order_by('-search_rank', '-id')
+            return list(qs.values_list('id', flat=True)[:50])
+
+        def like(term):
+            condition = Q()
+            for word in term.split():
+                condition &= Q(name__icontains=word) | Q(description__icontains=word)
+            return list(base.filter(condition).order_by('-created_at').values_list('id', flat=True)[:50])
+
+        for label, search in (('full-text', full_text), ('LIKE', like)):
+            for kind, terms in queries.items():
+                timings = []
+                for term in terms:
+                    start = time.perf_counter()
+                    search(term)
+                    timings.append((time.perf_counter() - start) * 1000)
+                self.report(f'{label} {kind}', timings)
+
+    def report(self, label, timings):
+        cuts = statistics.quantiles(timings, n=100, method='inclusive')
+        self.stdout.write(
+            f"{label:>18}: p50={cuts[49]:.2f}ms p95={cuts[94]:.2f}ms "
+            f"p99={cuts[98]:.2f}ms max={max(timings):.2f}ms"
+        )
@@ -0,0 +1,54 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.management.commands.benchmark_search import build_vocabulary
+from products.suggest import PrefixIndex
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the in-memory suggestion index on synthetic product names'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=10_000)
+        parser.add_argument('--vocabulary', type=int, default=5_000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        words = build_vocabulary(rng, options['vocabulary'])
+        rows = [
+            ('product', i, ' '.join(rng.sample(words, 3)), f'product-{i}')
+            for i in range(options['products'])
+        ]
+
+        index = PrefixIndex()
+        start = time.perf_counter()
+        index.load(rows)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Indexed {len(index)} names in {elapsed:.2f}s, "
+            f"~{index.memory_bytes() / 1024 / 1024:.1f} MiB"
+        )
+
+        timings = []
+        for _ in range(options['queries']):
+            word = rng.choice(words)
+            prefix = word[:rng.randint(1, len(word))]
+            start = time.perf_counter()
+            index.search(prefix, limit=10)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        cuts = statistics.quantiles(timings, n=100, method='inclusive')
+        self.stdout.write(
+            f"search: p50={cuts[49]:.3f}ms p95={cuts[94]:.3f}ms "
+            f"p99={cuts[98]:.3f}ms max={max(timings):.3f}ms"
+        )
+
+        start = time.perf_counter()
+        for i in range(1000):
+            index.upsert('product', i, ' '.join(rng.sample(words, 3)), f'product-{i}')
+        elapsed = (time.perf_counter() - start) / 1000 * 1000
+        self.stdout.write(f"incremental upsert: {elapsed:.3f}ms per product")
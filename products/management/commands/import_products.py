@@ -0,0 +1,29 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import INPUTS, FeedError, ProductImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Upsert products from a CSV or JSON Lines supplier feed in chunked bulk writes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Feed file')
+        parser.add_argument('--input', choices=INPUTS, help='Feed type, taken from the file extension by default')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        input_type = options['input'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        try:
+            with open(options['path'], newline='', encoding='utf-8') as feed:
+                report = ProductImporter(chunk_size=options['chunk_size']).run(read_rows(feed, input_type))
+        except (FeedError, OSError) as e:
+            raise CommandError(str(e))
+
+        for error in report['errors']:
+            self.stderr.write(f"Row {error['row']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['imported']} of {report['rows']} rows in {report['seconds']:.2f}s "
+            f"({report['rows_per_second']} rows/sec), {report['failed']} failed"
+        ))
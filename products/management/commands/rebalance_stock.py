@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.inventory import disable_sharding, enable_sharding, rebalance
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Even out sharded stock counters and refresh the displayed stock, or turn sharding on/off for a product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', help='Limit to these product ids')
+        parser.add_argument('--enable', type=int, metavar='SHARDS', help='Split the stock of --product over SHARDS rows')
+        parser.add_argument('--disable', action='store_true', help='Fold the stock of --product back into one row')
+
+    def handle(self, *args, **options):
+        product_ids = options['product']
+        if options['enable'] is not None or options['disable']:
+            if not product_ids:
+                raise CommandError('--enable and --disable need --product')
+            if options['enable'] is not None and options['enable'] < 1:
+                raise CommandError('--enable needs at least 1 shard')
+            for product_id in product_ids:
+                try:
+                    if options['disable']:
+                        disable_sharding(product_id)
+                    else:
+                        enable_sharding(product_id, options['enable'])
+                except Product.DoesNotExist:
+                    raise CommandError(f'Product {product_id} does not exist')
+            action = 'Unsharded' if options['disable'] else f"Sharded ({options['enable']} rows)"
+            self.stdout.write(self.style.SUCCESS(f'{action}: {len(product_ids)} products'))
+            return
+
+        totals = rebalance(product_ids)
+        self.stdout.write(self.style.SUCCESS(f'Rebalanced {len(totals)} sharded products'))
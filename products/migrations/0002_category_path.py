@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:04
+
+from django.db import migrations, models
+
+
+def populate_category_paths(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    categories = list(Category.objects.only('id', 'parent_id'))
+    parents = {category.id: category.parent_id for category in categories}
+    paths = {}
+
+    def build_path(category_id):
+        if category_id not in paths:
+            parent_id = parents[category_id]
+            prefix = build_path(parent_id) if parent_id else ''
+            paths[category_id] = f"{prefix}{category_id}/"
+        return paths[category_id]
+
+    for category in categories:
+        category.path = build_path(category.id)
+    Category.objects.bulk_update(categories, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_category_paths, migrations.RunPython.noop),
+    ]
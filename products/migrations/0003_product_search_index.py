@@ -0,0 +1,26 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_category_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchIndex',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='products.product')),
+                ('document', models.TextField(db_column='products_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'products_fts',
+                'managed': False,
+            },
+        ),
+    ]
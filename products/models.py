@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from django.utils.text import slugify
 
 
@@ -8,6 +10,8 @@ class Category(models.Model):
     slug = models.SlugField(max_length=100, unique=True)
     description = models.TextField(blank=True, null=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    # Materialized path of ancestor ids, e.g. "1/4/9/", for prefix lookups of subtrees
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -19,6 +23,26 @@ class Category(models.Model):
         if not self.slug:
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
+        self.update_path()
+    
+    def build_path(self):
+        if self.parent_id:
+            return f"{self.parent.path}{self.pk}/"
+        return f"{self.pk}/"
+    
+    def update_path(self):
+        """Recompute the path and rewrite descendant paths if it moved"""
+        old_path = self.path
+        new_path = self.build_path()
+        if new_path == old_path:
+            return
+        
+        Category.objects.filter(pk=self.pk).update(path=new_path)
+        if old_path:
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1))
+            )
+        self.path = new_path
     
     def __str__(self):
         return self.name
@@ -32,6 +56,8 @@ class Product(models.Model):
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField(default=0)
+    # Number of ProductStockShard rows holding the stock, 0 when stock lives in this row
+    stock_shards = models.PositiveSmallIntegerField(default=0)
     image_url = models.URLField(max_length=500, blank=True, null=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -51,4 +77,31 @@ class Product(models.Model):
         super().save(*args, **kwargs)
     
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class ProductStockShard(models.Model):
+    """Slice of a hot product's stock, so concurrent checkouts update different rows"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_shard_rows')
+    shard = models.PositiveSmallIntegerField()
+    stock = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'product_stock_shards'
+        unique_together = ('product', 'shard')
+    
+    def __str__(self):
+        return f"{self.product_id} shard {self.shard}: {self.stock}"
+
+
+class ProductSearchIndex(models.Model):
+    """Read-only view of the SQLite FTS5 product index (see products.search)"""
+    product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True,
+                                   db_column='rowid', related_name='search_index')
+    # The FTS5 hidden column named after the table, the target of MATCH queries
+    document = models.TextField(db_column='products_fts')
+    rank = models.FloatField()
+    
+    class Meta:
+        managed = False
+        db_table = 'products_fts'
@@ -0,0 +1,154 @@
+import logging
+import re
+
+from django.db import DatabaseError, connections
+from django.db.models import BooleanField, F, FloatField, Lookup, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Product, ProductSearchIndex
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS_TABLE = Product._meta.db_table
+FTS_TABLE = ProductSearchIndex._meta.db_table
+
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce({table}name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce({table}description, '')), 'B')"
+)
+
+SQLITE_INDEX_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description, content='{PRODUCTS_TABLE}', content_rowid='id', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON {PRODUCTS_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON {PRODUCTS_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF name, description ON {PRODUCTS_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    # Name matches weigh more than description matches
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+]
+
+# Backfills the index from existing rows, only needed when the table is new
+SQLITE_REBUILD_SQL = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+
+POSTGRES_INDEX_SQL = [
+    f"CREATE INDEX IF NOT EXISTS {PRODUCTS_TABLE}_search_idx ON {PRODUCTS_TABLE} "
+    f"USING GIN (({POSTGRES_DOCUMENT.format(table='')}))",
+]
+
+# Last words this short match so much of the catalog that ranking every match is slower than
+# LIKE; such prefixes rank only the newest PREFIX_CANDIDATES matches
+SHORT_PREFIX_LENGTH = 3
+PREFIX_CANDIDATES = 1000
+
+_fts_ready = set()
+
+
+class Match(Lookup):
+    """FTS5 MATCH against the hidden table column"""
+    lookup_name = 'match'
+    
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+ProductSearchIndex._meta.get_field('document').register_lookup(Match)
+
+
+def ensure_search_index(using='default'):
+    """Create the full-text index and the triggers that keep it in sync"""
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        statements = list(SQLITE_INDEX_SQL)
+        if FTS_TABLE not in connection.introspection.table_names():
+            statements.append(SQLITE_REBUILD_SQL)
+    elif connection.vendor == 'postgresql':
+        statements = POSTGRES_INDEX_SQL
+    else:
+        return
+
+    try:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    except DatabaseError:
+        logger.warning("Full-text search index unavailable, falling back to LIKE search", exc_info=True)
+        return
+    _fts_ready.add(using)
+
+
+def search_backend(using='default'):
+    """Name of the full-text backend for this database, or None"""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        return 'postgresql'
+    if connection.vendor == 'sqlite':
+        if using not in _fts_ready and FTS_TABLE in connection.introspection.table_names():
+            _fts_ready.add(using)
+        if using in _fts_ready:
+            return 'sqlite'
+    return None
+
+
+def search_terms(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def limit_candidates(queryset, candidate_ids):
+    """Restrict to the newest PREFIX_CANDIDATES matches when there are more than that"""
+    ids = list(candidate_ids[:PREFIX_CANDIDATES + 1])
+    if len(ids) > PREFIX_CANDIDATES:
+        return queryset.filter(id__in=ids[:PREFIX_CANDIDATES])
+    return queryset
+
+
+def search_products(queryset, text):
+    """Filter a product queryset to matches and annotate a search_rank (higher is better)"""
+    terms = search_terms(text)
+    if not terms:
+        return queryset
+
+    backend = search_backend(queryset.db)
+    table = connections[queryset.db].ops.quote_name(PRODUCTS_TABLE)
+
+    if backend == 'sqlite':
+        # Every term must match, the last one as a prefix for type-ahead.
+        # Joining the index lets FTS5 compute bm25 rank once per match.
+        match = ' '.join(f'"{term}"' for term in terms[:-1])
+        match = f'{match} "{terms[-1]}"*'.strip()
+        if len(terms[-1]) <= SHORT_PREFIX_LENGTH:
+            # Candidates come from the filtered queryset, so category, price and is_active filters still apply.
+            # An id IN (match) subquery is several times faster here than joining the index.
+            matched = ProductSearchIndex.objects.using(queryset.db).filter(document__match=match).values('product')
+            candidates = queryset.filter(id__in=matched).order_by('-id')
+            queryset = limit_candidates(queryset, candidates.values_list('id', flat=True))
+        return queryset.filter(search_index__document__match=match).annotate(
+            search_rank=-F('search_index__rank')
+        )
+
+    if backend == 'postgresql':
+        tsquery = ' & '.join(terms[:-1] + [f'{terms[-1]}:*'])
+        document = POSTGRES_DOCUMENT.format(table=f'{table}.')
+        matches = RawSQL(f"({document}) @@ to_tsquery('english', %s)", [tsquery], output_field=BooleanField())
+        if len(terms[-1]) <= SHORT_PREFIX_LENGTH:
+            candidates = queryset.filter(matches).order_by('-id')
+            queryset = limit_candidates(queryset, candidates.values_list('id', flat=True))
+        return queryset.filter(matches).annotate(search_rank=RawSQL(
+            f"ts_rank(({document}), to_tsquery('english', %s))", [tsquery], output_field=FloatField()
+        ))
+
+    condition = Q()
+    for term in terms:
+        condition &= Q(name__icontains=term) | Q(description__icontains=term)
+    return queryset.filter(condition)
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from .inventory import MAX_STOCK
 from .models import Category, Product
 
 
@@ -11,9 +12,14 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'slug', 'created_at', 'updated_at')
     
     def get_children(self, obj):
-        if obj.children.exists():
-            return CategorySerializer(obj.children.all(), many=True).data
-        return []
+        # Views pass a parent -> children map built from one flat query;
+        # fall back to the relation when serialized on its own.
+        children_map = self.context.get('children_map')
+        if children_map is None:
+            children = obj.children.all()
+        else:
+            children = children_map.get(obj.id, [])
+        return CategorySerializer(children, many=True, context=self.context).data
 
 
 class ProductListSerializer(serializers.ModelSerializer):
@@ -59,4 +65,32 @@ class ProductCreateUpdateSerializer(serializers.ModelSerializer):
     def validate_stock(self, value):
         if value < 0:
             raise serializers.ValidationError("Stock cannot be negative")
-        return value
\ No newline at end of file
+        # Sharded stock lives in the shard rows, rebalance would overwrite a value written here
+        if self.instance is not None and self.instance.stock_shards and value != self.instance.stock:
+            raise serializers.ValidationError("Stock is sharded, disable sharding before setting it")
+        return value
+
+
+class StockPriceUpdateSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    stock = serializers.IntegerField(required=False, min_value=-MAX_STOCK, max_value=MAX_STOCK)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    
+    def validate(self, attrs):
+        if 'stock' not in attrs and 'price' not in attrs:
+            raise serializers.ValidationError('Give stock, price or both.')
+        return attrs
+
+
+class BulkStockPriceSerializer(serializers.Serializer):
+    """Absolute values with mode=set, signed changes with mode=adjust"""
+    mode = serializers.ChoiceField(choices=['set', 'adjust'], default='set')
+    updates = StockPriceUpdateSerializer(many=True, allow_empty=False, max_length=10000)
+    
+    def validate_updates(self, value):
+        seen = set()
+        for update in value:
+            if update['id'] in seen:
+                raise serializers.ValidationError(f"Product {update['id']} appears more than once.")
+            seen.add(update['id'])
+        return value
@@ -0,0 +1,54 @@
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from .cache import bump_catalog_version, bump_suggestion_version
+from .models import Category, Product
+from .suggest import suggestion_index
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version()
+
+
+# Fields the suggestion index shows or filters on, other saves leave it alone
+SUGGESTION_FIELDS = {
+    Product: ('name', 'slug', 'is_active'),
+    Category: ('name', 'slug'),
+}
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=Category)
+def remember_suggestion_fields(sender, instance, update_fields=None, **kwargs):
+    fields = SUGGESTION_FIELDS[sender]
+    if update_fields is not None and not set(update_fields) & set(fields):
+        instance._suggestion_state = tuple(getattr(instance, field) for field in fields)
+    elif instance.pk is None:
+        instance._suggestion_state = None
+    else:
+        instance._suggestion_state = sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def update_suggestions(sender, instance, created, **kwargs):
+    state = tuple(getattr(instance, field) for field in SUGGESTION_FIELDS[sender])
+    if not created and getattr(instance, '_suggestion_state', None) == state:
+        return
+    kind = 'product' if sender is Product else 'category'
+    version = bump_suggestion_version()
+    if kind == 'product' and not instance.is_active:
+        suggestion_index.apply(version, suggestion_index.remove, kind, instance.pk)
+    else:
+        suggestion_index.apply(version, suggestion_index.upsert, kind, instance.pk, instance.name, instance.slug)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def remove_suggestions(sender, instance, **kwargs):
+    kind = 'product' if sender is Product else 'category'
+    version = bump_suggestion_version()
+    suggestion_index.apply(version, suggestion_index.remove, kind, instance.pk)
@@ -0,0 +1,182 @@
+import re
+import sys
+import threading
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import get_suggestion_version
+from .models import Category, Product
+
+# Held while one process rebuilds, the others keep answering from their current index
+REBUILD_LOCK_KEY = 'catalog:suggestion_rebuild'
+REBUILD_LOCK_TIMEOUT = 60
+
+# Only the first few words of a name are indexed to keep memory bounded
+MAX_WORDS_PER_NAME = 4
+
+# Entries are "<key>\0<ref>" strings, the NUL keeps each key sorted before its extensions
+SEPARATOR = '\0'
+KIND_CODES = {'category': 'c', 'product': 'p'}
+KIND_NAMES = {code: kind for kind, code in KIND_CODES.items()}
+
+
+def normalize(text):
+    return ' '.join(re.findall(r'\w+', text.lower()))
+
+
+def suggestion_keys(name):
+    """Normalized keys for a name: the full name and each word suffix"""
+    words = normalize(name).split()[:MAX_WORDS_PER_NAME]
+    return {' '.join(words[i:]) for i in range(len(words))}
+
+
+class PrefixIndex:
+    """In-process type-ahead index kept as a sorted array of strings searched with bisect"""
+
+    def __init__(self, max_products=None):
+        self._entries = []  # sorted "<key>\0<ref>" strings
+        self._docs = {}  # ref ("p12", "c3") -> (name, slug)
+        self._lock = threading.RLock()
+        self._rebuilding = threading.Lock()
+        self.version = None
+        self.loaded = False
+        # Newest products kept when the catalog is larger, None for no limit
+        self.max_products = max_products
+        self.product_count = 0
+
+    def rebuild(self, version=None):
+        categories = Category.objects.values_list('id', 'name', 'slug')
+        products = Product.objects.filter(is_active=True).order_by('-id').values_list('id', 'name', 'slug')
+        if self.max_products is not None:
+            products = products[:self.max_products]
+        rows = [('category', *row) for row in categories.iterator(chunk_size=5000)]
+        rows += [('product', *row) for row in products.iterator(chunk_size=5000)]
+        self.load(rows, version)
+
+    def load(self, rows, version=None):
+        """Replace the index contents with (kind, id, name, slug) rows"""
+        entries = []
+        docs = {}
+        product_count = 0
+        for kind, obj_id, name, slug in rows:
+            if kind == 'product':
+                if self.max_products is not None and product_count >= self.max_products:
+                    continue
+                product_count += 1
+            ref = f'{KIND_CODES[kind]}{obj_id}'
+            docs[ref] = (name, slug)
+            entries.extend(f'{key}{SEPARATOR}{ref}' for key in suggestion_keys(name))
+        entries.sort()
+        with self._lock:
+            self._entries = entries
+            self._docs = docs
+            self.product_count = product_count
+            self.version = version
+            self.loaded = True
+
+    def remove(self, kind, obj_id):
+        ref = f'{KIND_CODES[kind]}{obj_id}'
+        with self._lock:
+            doc = self._docs.pop(ref, None)
+            if doc is None:
+                return
+            if kind == 'product':
+                self.product_count -= 1
+            for key in suggestion_keys(doc[0]):
+                entry = f'{key}{SEPARATOR}{ref}'
+                i = bisect_left(self._entries, entry)
+                if i < len(self._entries) and self._entries[i] == entry:
+                    del self._entries[i]
+
+    def upsert(self, kind, obj_id, name, slug):
+        ref = f'{KIND_CODES[kind]}{obj_id}'
+        with self._lock:
+            self.remove(kind, obj_id)
+            if kind == 'product':
+                if self.max_products is not None and self.product_count >= self.max_products:
+                    # Full, make room by dropping the oldest product
+                    oldest = min(int(other[1:]) for other in self._docs if other[0] == KIND_CODES['product'])
+                    if oldest > obj_id:
+                        return
+                    self.remove('product', oldest)
+                self.product_count += 1
+            self._docs[ref] = (name, slug)
+            for key in suggestion_keys(name):
+                insort(self._entries, f'{key}{SEPARATOR}{ref}')
+
+    def apply(self, version, change, *args):
+        """Apply a local change, staying in sync only if no other writer got in between"""
+        with self._lock:
+            if self.version is None:
+                return
+            change(*args)
+            self.version = version if self.version == version - 1 else None
+
+    def search(self, prefix, limit=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        results = []
+        seen = set()
+        with self._lock:
+            i = bisect_left(self._entries, prefix)
+            while i < len(self._entries) and len(results) < limit:
+                entry = self._entries[i]
+                if not entry.startswith(prefix):
+                    break
+                ref = entry[entry.index(SEPARATOR) + 1:]
+                if ref not in seen:
+                    seen.add(ref)
+                    name, slug = self._docs[ref]
+                    results.append({'type': KIND_NAMES[ref[0]], 'id': int(ref[1:]), 'name': name, 'slug': slug})
+                i += 1
+        return results
+
+    def memory_bytes(self):
+        """Approximate memory held by the index"""
+        with self._lock:
+            total = sys.getsizeof(self._entries) + sys.getsizeof(self._docs)
+            total += sum(sys.getsizeof(entry) for entry in self._entries)
+            for ref, (name, slug) in self._docs.items():
+                total += sys.getsizeof(ref) + sys.getsizeof((name, slug))
+                total += sys.getsizeof(name) + sys.getsizeof(slug)
+            return total
+
+    def __len__(self):
+        return len(self._docs)
+
+
+suggestion_index = PrefixIndex(max_products=settings.SUGGESTION_INDEX_MAX_PRODUCTS)
+
+
+def get_suggestion_index():
+    """Shared index, rebuilt when another process renamed or removed items
+
+    A stale index keeps answering while one thread of one process rebuilds; only a process
+    that has never loaded the index waits for its first build.
+    """
+    version = get_suggestion_version()
+    if suggestion_index.version == version:
+        return suggestion_index
+
+    if suggestion_index.loaded:
+        if not suggestion_index._rebuilding.acquire(blocking=False):
+            return suggestion_index
+    else:
+        suggestion_index._rebuilding.acquire()
+    try:
+        if suggestion_index.version == version:
+            return suggestion_index
+        if not suggestion_index.loaded:
+            suggestion_index.rebuild(version)
+        elif cache.add(REBUILD_LOCK_KEY, True, timeout=REBUILD_LOCK_TIMEOUT):
+            try:
+                suggestion_index.rebuild(version)
+            finally:
+                cache.delete(REBUILD_LOCK_KEY)
+    finally:
+        suggestion_index._rebuilding.release()
+    return suggestion_index
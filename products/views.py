@@ -1,14 +1,27 @@
+import io
+import os
+from collections import defaultdict
 from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAdminUser
-from django.db.models import Q, Sum, Count, F
+from django.conf import settings
+from django.core.cache import cache
+from ecommerce_backend.pagination import CursorPaginationMixin
+from .cache import catalog_cache_key
+from .dashboard import get_dashboard
+from .facets import compute_facets
+from .filters import ProductSearchFilter
+from .importer import FeedError, ProductImporter, read_rows
+from .inventory import apply_stock_price_updates, available_stock
+from .suggest import get_suggestion_index
 from .models import Category, Product
 from .serializers import (
     CategorySerializer, 
     ProductListSerializer, 
     ProductDetailSerializer,
-    ProductCreateUpdateSerializer
+    ProductCreateUpdateSerializer,
+    BulkStockPriceSerializer
 )
 
 
@@ -23,28 +36,83 @@ class CategoryViewSet(viewsets.ModelViewSet):
             return [IsAdminUser()]
         return [IsAuthenticatedOrReadOnly()]
     
+    def get_categories(self):
+        """Fetch every category once for building trees in memory"""
+        if not hasattr(self, '_categories'):
+            self._categories = list(Category.objects.all())
+        return self._categories
+    
+    def get_children_map(self):
+        """Map each category id to its direct children"""
+        children_map = defaultdict(list)
+        for category in self.get_categories():
+            if category.parent_id is not None:
+                children_map[category.parent_id].append(category)
+        return children_map
+    
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ['list', 'retrieve', 'all']:
+            context['children_map'] = self.get_children_map()
+        return context
+    
     @action(detail=False, methods=['get'])
     def all(self, request):
         """Get all categories including nested ones"""
-        categories = Category.objects.all()
-        serializer = self.get_serializer(categories, many=True)
+        serializer = self.get_serializer(self.get_categories(), many=True)
         return Response(serializer.data)
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CursorPaginationMixin, viewsets.ModelViewSet):
     queryset = Product.objects.select_related('category').filter(is_active=True)
     permission_classes = [IsAuthenticatedOrReadOnly]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['name', 'description']
+    # Search runs last so it can order by relevance when no ordering is given
+    filter_backends = [filters.OrderingFilter, ProductSearchFilter]
     ordering_fields = ['price', 'created_at', 'name']
     ordering = ['-created_at']
+    # Query params that shape a list response, used for the cache key
+    list_cache_params = ['category', 'include_descendants', 'min_price', 'max_price',
+                         'in_stock', 'search', 'ordering', 'page', 'count', 'pagination', 'cursor',
+                         'facets']
+    
+    def list(self, request, *args, **kwargs):
+        # get_queryset treats staff differently, so only non-staff listings are cached
+        if request.user.is_staff:
+            return self.list_with_facets(request, *args, **kwargs)
+        
+        cache_key = catalog_cache_key('products:list', request.query_params, self.list_cache_params)
+        data = cache.get(cache_key)
+        if data is None:
+            response = self.list_with_facets(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(cache_key, response.data, settings.PRODUCT_LIST_CACHE_TIMEOUT)
+            return response
+        return Response(data)
+    
+    def list_with_facets(self, request, *args, **kwargs):
+        """Paginated list plus ?facets=category,price,in_stock for the same filters"""
+        response = super().list(request, *args, **kwargs)
+        
+        facets = request.query_params.get('facets', '')
+        requested = [facet.strip() for facet in facets.split(',') if facet.strip()]
+        if requested and response.status_code == status.HTTP_200_OK:
+            queryset = self.filter_queryset(self.get_queryset())
+            response.data['facets'] = compute_facets(queryset, requested)
+        return response
     
     def get_queryset(self):
         queryset = super().get_queryset()
         
         category = self.request.query_params.get('category', None)
         if category:
-            queryset = queryset.filter(category__slug=category)
+            include_descendants = self.request.query_params.get('include_descendants', None)
+            if include_descendants and include_descendants.lower() == 'true':
+                path = Category.objects.filter(slug=category).values_list('path', flat=True).first()
+                if path is None:
+                    return queryset.none()
+                queryset = queryset.filter(category__path__startswith=path)
+            else:
+                queryset = queryset.filter(category__slug=category)
         
         min_price = self.request.query_params.get('min_price', None)
         max_price = self.request.query_params.get('max_price', None)
@@ -56,7 +124,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         
         in_stock = self.request.query_params.get('in_stock', None)
         if in_stock and in_stock.lower() == 'true':
-            queryset = queryset.filter(stock__gt=0)
+            queryset = queryset.alias(available_stock=available_stock()).filter(available_stock__gt=0)
         
         if not self.request.user.is_staff:
             queryset = queryset.filter(is_active=True)
@@ -73,7 +141,8 @@ class ProductViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [IsAdminUser()]
-        return [IsAuthenticatedOrReadOnly()]
+        # Falls back to the action's own permission_classes, e.g. IsAdminUser on the admin actions
+        return super().get_permissions()
     
     @action(detail=False, methods=['get'])
     def featured(self, request):
@@ -82,52 +151,66 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer = ProductListSerializer(featured_products, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """Type-ahead suggestions for product and category names"""
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            limit = 10
+        
+        return Response(get_suggestion_index().search(query, limit=limit))
+    
     @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
     def low_stock(self, request):
         """Get low stock products (admin only)"""
-        low_stock_products = Product.objects.filter(stock__lt=10, is_active=True)
+        low_stock_products = list(
+            Product.objects.annotate(available_stock=available_stock()).filter(available_stock__lt=10, is_active=True)
+        )
+        for product in low_stock_products:
+            product.stock = product.available_stock
         serializer = ProductListSerializer(low_stock_products, many=True)
         return Response(serializer.data)
     
-    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
-    def analytics(self, request):
-        """Admin analytics dashboard"""
-        from orders.models import Order, OrderItem
-        
-        # Total revenue
-        total_revenue = Order.objects.filter(
-            payment_status='success'
-        ).aggregate(total=Sum('total_amount'))['total'] or 0
-        
-        # Orders by status
-        orders_by_status = Order.objects.values('status').annotate(
-            count=Count('id')
-        ).order_by('status')
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def bulk_update(self, request):
+        """Set or adjust stock and price for many products in one request (admin only)"""
+        serializer = BulkStockPriceSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
         
-        # Top 10 selling products
-        top_products = OrderItem.objects.values(
-            'product__name', 'product__id'
-        ).annotate(
-            total_sold=Sum('quantity'),
-            revenue=Sum(F('quantity') * F('price_at_purchase'))
-        ).order_by('-total_sold')[:10]
+        updated, missing, errors = apply_stock_price_updates(
+            serializer.validated_data['updates'], serializer.validated_data['mode']
+        )
+        if errors:
+            return Response(
+                {'error': 'Batch rejected, no changes were applied', 'updates': errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Low stock products
-        low_stock = Product.objects.filter(
-            stock__lt=10, 
-            is_active=True
-        ).values('id', 'name', 'stock', 'category__name')
+        return Response({'updated': len(updated), 'missing': missing})
+    
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser], url_path='import')
+    def import_products(self, request):
+        """Upsert products from an uploaded CSV or JSON Lines feed (admin only)"""
+        feed = request.FILES.get('file')
+        if feed is None:
+            return Response(
+                {'error': 'Upload the feed as file'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        input_type = request.data.get('input') or os.path.splitext(feed.name)[1].lstrip('.').lower()
         
-        # Recent orders
-        from orders.serializers import OrderListSerializer
-        recent_orders = Order.objects.all().order_by('-created_at')[:10]
+        try:
+            # Read the upload as text line by line instead of loading it whole
+            rows = read_rows(io.TextIOWrapper(feed.file, encoding='utf-8', newline=''), input_type)
+            report = ProductImporter().run(rows)
+        except FeedError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        return Response({
-            'total_revenue': float(total_revenue),
-            'orders_by_status': list(orders_by_status),
-            'top_products': list(top_products),
-            'low_stock_products': list(low_stock),
-            'recent_orders': OrderListSerializer(recent_orders, many=True).data,
-            'total_products': Product.objects.count(),
-            'total_categories': Category.objects.count(),
-        })
\ No newline at end of file
+        return Response(report)
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def analytics(self, request):
+        """Admin analytics dashboard, cached for ANALYTICS_CACHE_TTL seconds"""
+        return Response(get_dashboard())
\ No newline at end of file
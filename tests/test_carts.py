@@ -0,0 +1,277 @@
+import pytest
+from rest_framework.test import APIClient
+from rest_framework import status
+from django.contrib.auth import get_user_model
+from products.models import Category, Product
+from carts.models import Cart, CartItem
+
+User = get_user_model()
+
+
+@pytest.fixture
+def api_client():
+    return APIClient()
+
+
+@pytest.fixture
+def test_user(db):
+    return User.objects.create_user(
+        username='testuser',
+        email='test@example.com',
+        password='TestPass123!'
+    )
+
+
+@pytest.fixture
+def authenticated_client(api_client, test_user):
+    api_client.force_authenticate(user=test_user)
+    return api_client
+
+
+@pytest.fixture
+def category(db):
+    return Category.objects.create(name='Electronics')
+
+
+@pytest.fixture
+def products(db, category):
+    return [
+        Product.objects.create(name=f'Product {i}', category=category, price=10 + i, stock=20)
+        for i in range(50)
+    ]
+
+
+@pytest.mark.django_db
+class TestCart:
+    
+    def test_view_cart_query_count(self, authenticated_client, test_user, products, django_assert_num_queries):
+        """Test a 50 item cart is read with a fixed number of queries"""
+        cart = Cart.objects.create(user=test_user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=2) for product in products
+        ])
+        
+        # Cart lookup plus one prefetch of items, products and categories
+        with django_assert_num_queries(2):
+            response = authenticated_client.get('/api/cart/')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['items']) == 50
+        assert response.data['total_items'] == 100
+        assert response.data['total_amount'] == sum((10 + i) * 2 for i in range(50))
+        assert response.data['items'][0]['product']['category_name'] == 'Electronics'
+    
+    def test_add_item_to_cart(self, authenticated_client, products):
+        """Test adding an item returns the updated cart"""
+        response = authenticated_client.post('/api/cart/add/', {'product_id': products[0].id, 'quantity': 3})
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['total_items'] == 3
+        
+        response = authenticated_client.post('/api/cart/add/', {'product_id': products[0].id, 'quantity': 30})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+    
+    def test_batch_operations(self, authenticated_client, test_user, products, django_assert_num_queries):
+        """Test a batch of operations runs in a fixed number of queries"""
+        cart = Cart.objects.create(user=test_user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=1) for product in products[:10]
+        ])
+        operations = (
+            [{'op': 'add', 'product_id': product.id, 'quantity': 2} for product in products[5:30]]
+            + [{'op': 'update', 'product_id': product.id, 'quantity': 7} for product in products[:3]]
+            + [{'op': 'remove', 'product_id': product.id} for product in products[3:5]]
+        )
+        
+        # Products, cart, savepoint, lock, items, bulk create/update/delete, release, response
+        with django_assert_num_queries(10):
+            response = authenticated_client.post('/api/cart/batch/', {'operations': operations}, format='json')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['items']) == 28
+        quantities = dict(cart.items.values_list('product_id', 'quantity'))
+        assert quantities[products[0].id] == 7
+        assert quantities[products[5].id] == 3
+        assert quantities[products[20].id] == 2
+        assert products[3].id not in quantities
+    
+    def test_batch_rejects_all_on_error(self, authenticated_client, test_user, products):
+        """Test an invalid operation leaves the cart untouched"""
+        cart = Cart.objects.create(user=test_user)
+        CartItem.objects.create(cart=cart, product=products[0], quantity=1)
+        
+        response = authenticated_client.post('/api/cart/batch/', {'operations': [
+            {'op': 'remove', 'product_id': products[0].id},
+            {'op': 'add', 'product_id': products[1].id, 'quantity': 25},
+            {'op': 'update', 'product_id': products[2].id, 'quantity': 1},
+        ]}, format='json')
+        
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert set(response.data['operations']) == {1, 2}
+        assert list(cart.items.values_list('product_id', flat=True)) == [products[0].id]
+    
+    def test_login_merges_session_cart(self, api_client, test_user, products):
+        """Test guest items merge into the user cart, clamped to stock"""
+        user_cart = Cart.objects.create(user=test_user)
+        CartItem.objects.create(cart=user_cart, product=products[0], quantity=15)
+        api_client.post('/api/cart/batch/', {'operations': [
+            {'op': 'add', 'product_id': products[0].id, 'quantity': 10},
+            {'op': 'add', 'product_id': products[1].id, 'quantity': 2},
+        ]}, format='json')
+        
+        response = api_client.post('/api/auth/login/', {'username': 'testuser', 'password': 'TestPass123!'})
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert dict(user_cart.items.values_list('product_id', 'quantity')) == {
+            products[0].id: 20,
+            products[1].id: 2,
+        }
+        assert not Cart.objects.filter(user=None).exists()
+    
+    def test_login_merge_clamps_to_sharded_stock(self, api_client, test_user, products):
+        """Test merged quantities are clamped to the shard rows, not the display copy of stock"""
+        from products.inventory import enable_sharding
+        from products.models import ProductStockShard
+        
+        enable_sharding(products[0].id, 2)
+        api_client.post('/api/cart/add/', {'product_id': products[0].id, 'quantity': 10})
+        # Checkouts drained the shards, Product.stock still says 20
+        ProductStockShard.objects.filter(product=products[0]).update(stock=2)
+        
+        api_client.post('/api/auth/login/', {'username': 'testuser', 'password': 'TestPass123!'})
+        
+        assert list(CartItem.objects.filter(cart__user=test_user).values_list('quantity', flat=True)) == [4]
+    
+    def test_login_drops_empty_session_cart(self, api_client, test_user):
+        """Test an empty guest cart is deleted on login"""
+        api_client.get('/api/cart/')
+        assert Cart.objects.filter(user=None).exists()
+        
+        response = api_client.post('/api/auth/login/', {'username': 'testuser', 'password': 'TestPass123!'})
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert not Cart.objects.filter(user=None).exists()
+
+
+@pytest.fixture
+def hot_store(settings):
+    from carts import store
+    
+    settings.CART_STORE = 'redis'
+    settings.CART_REDIS_URL = 'memory://'
+    store._stores.clear()
+    yield store.get_cart_store()
+    store._stores.clear()
+
+
+@pytest.mark.django_db
+class TestHotCartStore:
+    
+    def test_add_and_view_skip_cart_tables(self, authenticated_client, products, hot_store, django_assert_num_queries):
+        """Test hot cart writes and reads only query products"""
+        authenticated_client.post('/api/cart/add/', {'product_id': products[0].id, 'quantity': 1})
+        
+        # Product validation plus one product read for the response
+        with django_assert_num_queries(3):
+            response = authenticated_client.post('/api/cart/add/', {'product_id': products[0].id, 'quantity': 2})
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['total_items'] == 3
+        assert response.data['items'][0]['id'] == products[0].id
+        assert not CartItem.objects.exists()
+        
+        response = authenticated_client.post('/api/cart/add/', {'product_id': products[0].id, 'quantity': 20})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert authenticated_client.get('/api/cart/').data['total_items'] == 3
+    
+    def test_flush_writes_dirty_carts(self, authenticated_client, test_user, products, hot_store):
+        """Test write-behind flush upserts items and removes deleted ones"""
+        cart = Cart.objects.create(user=test_user)
+        CartItem.objects.create(cart=cart, product=products[1], quantity=5)
+        
+        authenticated_client.post('/api/cart/add/', {'product_id': products[0].id, 'quantity': 2})
+        authenticated_client.delete(f'/api/cart/items/{products[1].id}/')
+        
+        assert hot_store.flush_dirty() == 1
+        assert list(cart.items.values_list('product_id', 'quantity')) == [(products[0].id, 2)]
+        assert hot_store.flush_dirty() == 0
+    
+    def test_checkout_reads_hot_cart(self, authenticated_client, products, hot_store):
+        """Test checkout persists the hot cart before creating the order"""
+        authenticated_client.post('/api/cart/add/', {'product_id': products[0].id, 'quantity': 2})
+        
+        response = authenticated_client.post('/api/orders/create_order/', {'shipping_address': '1 Main St'})
+        
+        assert response.status_code == status.HTTP_201_CREATED
+        assert authenticated_client.get('/api/cart/').data['total_items'] == 0
+    
+    def test_batch_hot_cart(self, authenticated_client, products, hot_store):
+        """Test batch operations apply to the hot cart"""
+        authenticated_client.post('/api/cart/add/', {'product_id': products[0].id, 'quantity': 1})
+        
+        response = authenticated_client.post('/api/cart/batch/', {'operations': [
+            {'op': 'remove', 'product_id': products[0].id},
+            {'op': 'add', 'product_id': products[1].id, 'quantity': 4},
+        ]}, format='json')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert hot_store.get_items(f'user:{response.wsgi_request.user.pk}') == {products[1].id: 4}
+        assert not CartItem.objects.exists()
+    
+    def test_hot_cart_rejects_bad_item_ids(self, authenticated_client, products, hot_store):
+        """Test non-numeric item ids are not found instead of failing"""
+        authenticated_client.post('/api/cart/add/', {'product_id': products[0].id, 'quantity': 1})
+        
+        response = authenticated_client.patch('/api/cart/items/abc/', {'quantity': 2})
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        response = authenticated_client.delete('/api/cart/items/_loaded/')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert authenticated_client.get('/api/cart/').data['total_items'] == 1
+    
+    def test_persist_keeps_carts_written_during_flush(self, test_user, products, hot_store):
+        """Test a cart written after its snapshot stays in the store for the next flush"""
+        from carts.store import cart_owner, persist_carts
+        
+        owner = cart_owner(user=test_user)
+        hot_store.add(owner, products[0].id, 1)
+        
+        original = hot_store.parse_items
+        
+        def write_during_flush(values):
+            items = original(values)
+            hot_store.add(owner, products[1].id, 3)
+            return items
+        
+        hot_store.parse_items = write_during_flush
+        persist_carts(owner)
+        hot_store.parse_items = original
+        
+        assert CartItem.objects.filter(cart__user=test_user).count() == 1
+        assert hot_store.get_items(owner) == {products[0].id: 1, products[1].id: 3}
+        
+        persist_carts(owner)
+        assert CartItem.objects.filter(cart__user=test_user).count() == 2
+        assert not hot_store.client.exists(hot_store.cart_key(owner))
+    
+    def test_concurrent_first_touch_keeps_writes(self, test_user, products, hot_store):
+        """Test a cart seeded by one request is not reseeded over another request's write"""
+        from carts.store import cart_owner
+        
+        cart = Cart.objects.create(user=test_user)
+        CartItem.objects.create(cart=cart, product=products[0], quantity=1)
+        owner = cart_owner(user=test_user)
+        
+        database_items = hot_store.database_items
+        
+        def other_request_first(owner):
+            items = list(database_items(owner))
+            # The other request seeds the cart and adds while this one is still reading the database
+            hot_store.database_items = database_items
+            hot_store.add(owner, products[0].id, 2)
+            return items
+        
+        hot_store.database_items = other_request_first
+        hot_store.load(owner)
+        hot_store.database_items = database_items
+        
+        assert hot_store.get_items(owner) == {products[0].id: 3}
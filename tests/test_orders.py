@@ -2,6 +2,7 @@ import pytest
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
+from django.db.models import Sum
 from products.models import Category, Product
 from carts.models import Cart, CartItem
 from orders.models import Order
@@ -121,4 +122,389 @@ class TestOrders:
         
         # Check stock was restored
         product.refresh_from_db()
-        assert product.stock == 10
\ No newline at end of file
+        assert product.stock == 10
+    
+    def test_create_order_query_count(self, authenticated_client, test_user, category, django_assert_num_queries):
+        """Test a 30 line checkout runs a fixed number of statements"""
+        products = [
+            Product.objects.create(name=f'Product {i}', category=category, price=10, stock=5)
+            for i in range(30)
+        ]
+        cart = Cart.objects.create(user=test_user)
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=p, quantity=2) for p in products])
+        
+        # Cart, savepoint, write lock, items, lock, stock update, order, order items, reservations,
+        # cart delete, release, response
+        with django_assert_num_queries(12):
+            response = authenticated_client.post('/api/orders/create_order/', {'shipping_address': 'Test address'})
+        
+        assert response.status_code == status.HTTP_201_CREATED
+        assert len(response.data['items']) == 30
+        assert float(response.data['items'][0]['subtotal']) == 20.00
+        assert set(Product.objects.values_list('stock', flat=True)) == {3}
+        assert not cart.items.exists()
+    
+    def test_create_order_insufficient_stock(self, authenticated_client, cart_with_items, product):
+        """Test checkout rolls back when stock ran out"""
+        Product.objects.filter(id=product.id).update(stock=1)
+        
+        response = authenticated_client.post('/api/orders/create_order/', {'shipping_address': 'Test address'})
+        
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'Insufficient stock' in response.data['error']
+        assert not Order.objects.exists()
+        assert cart_with_items.items.count() == 1
+    
+    def test_checkout_sharded_stock(self, authenticated_client, cart_with_items, product):
+        """Test checkout and cancel take and return stock across shard rows"""
+        from products.inventory import enable_sharding, rebalance
+        from products.models import ProductStockShard
+        
+        enable_sharding(product.id, 3)
+        # 4 + 3 + 3, the order for 2 fits in any single shard
+        response = authenticated_client.post('/api/orders/create_order/', {'shipping_address': 'Test address'})
+        assert response.status_code == status.HTTP_201_CREATED
+        assert ProductStockShard.objects.filter(product=product).aggregate(Sum('stock'))['stock__sum'] == 8
+        
+        # 7 does not fit in one shard and is drained from several
+        CartItem.objects.create(cart=cart_with_items, product=product, quantity=7)
+        response = authenticated_client.post('/api/orders/create_order/', {'shipping_address': 'Test address'})
+        assert response.status_code == status.HTTP_201_CREATED
+        
+        CartItem.objects.create(cart=cart_with_items, product=product, quantity=2)
+        response = authenticated_client.post('/api/orders/create_order/', {'shipping_address': 'Test address'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        
+        order = Order.objects.order_by('id').first()
+        assert authenticated_client.post(f'/api/orders/{order.id}/cancel/').status_code == status.HTTP_200_OK
+        assert rebalance() == {product.id: 3}
+        assert sorted(ProductStockShard.objects.values_list('stock', flat=True)) == [1, 1, 1]
+        product.refresh_from_db()
+        assert product.stock == 3
+    
+    def test_expired_reservation_released(self, authenticated_client, cart_with_items, product):
+        """Test unpaid orders give their stock back once the hold expires"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from orders.services import commit_reservations, release_expired_reservations
+        
+        response = authenticated_client.post('/api/orders/create_order/', {'shipping_address': 'Test address'})
+        order = Order.objects.get(id=response.data['id'])
+        assert order.reservations.get().quantity == 2
+        
+        assert release_expired_reservations() == 0
+        assert release_expired_reservations(now=timezone.now() + timedelta(minutes=31)) == 1
+        
+        order.refresh_from_db()
+        product.refresh_from_db()
+        assert order.status == 'cancelled'
+        assert product.stock == 10
+        assert not order.reservations.exists()
+        
+        # Paid after the hold was released, the stock is taken again
+        commit_reservations(order)
+        product.refresh_from_db()
+        assert product.stock == 8
+    
+    def test_late_payment_retake_is_all_or_nothing(self, test_user, category, product):
+        """Test a late payment takes no stock at all when one product of the order has run out"""
+        from django.db import transaction
+        from orders.models import OrderItem
+        from orders.services import commit_reservations
+        from products.inventory import enable_sharding
+        
+        sharded = Product.objects.create(name='Sharded Product', category=category, price=50, stock=2)
+        enable_sharding(sharded.id, 2)
+        order = Order.objects.create(
+            user=test_user, total_amount=450, shipping_address='Test address', status='cancelled'
+        )
+        OrderItem.objects.create(order=order, product=product, quantity=3, price_at_purchase=100, subtotal=300)
+        OrderItem.objects.create(order=order, product=sharded, quantity=3, price_at_purchase=50, subtotal=150)
+        
+        with transaction.atomic():
+            commit_reservations(order)
+        
+        product.refresh_from_db()
+        assert product.stock == 10
+    
+    def test_create_order_idempotency_key(self, authenticated_client, cart_with_items, product):
+        """Test a retried create_order replays the first response"""
+        data = {'shipping_address': 'Test address'}
+        first = authenticated_client.post('/api/orders/create_order/', data, HTTP_IDEMPOTENCY_KEY='abc-123')
+        CartItem.objects.create(cart=cart_with_items, product=product, quantity=1)
+        retry = authenticated_client.post('/api/orders/create_order/', data, HTTP_IDEMPOTENCY_KEY='abc-123')
+        
+        assert first.status_code == retry.status_code == status.HTTP_201_CREATED
+        assert retry.data['id'] == first.data['id']
+        assert retry['Idempotent-Replayed'] == 'true'
+        assert Order.objects.count() == 1
+        
+        reused = authenticated_client.post('/api/orders/create_order/', {'shipping_address': 'Other'}, HTTP_IDEMPOTENCY_KEY='abc-123')
+        assert reused.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    
+    def test_abandoned_idempotency_key_runs_again(self, authenticated_client, test_user, cart_with_items):
+        """Test a key whose first request never finished is busy for the lease, then runs again"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from orders.models import IdempotencyRecord
+        
+        data = {'shipping_address': 'Test address'}
+        # What a worker killed mid-request leaves behind
+        record = IdempotencyRecord.objects.create(
+            user=test_user, scope='orders.create_order', key='abc-123', fingerprint='unfinished'
+        )
+        response = authenticated_client.post('/api/orders/create_order/', data, HTTP_IDEMPOTENCY_KEY='abc-123')
+        assert response.status_code == status.HTTP_409_CONFLICT
+        
+        IdempotencyRecord.objects.filter(pk=record.pk).update(created_at=timezone.now() - timedelta(minutes=10))
+        response = authenticated_client.post('/api/orders/create_order/', data, HTTP_IDEMPOTENCY_KEY='abc-123')
+        
+        assert response.status_code == status.HTTP_201_CREATED
+        assert Order.objects.count() == 1
+        record.refresh_from_db()
+        assert record.status_code == status.HTTP_201_CREATED
+    
+    def test_list_orders_query_count(self, authenticated_client, test_user, product, django_assert_num_queries):
+        """Test order history counts items in SQL without loading them"""
+        from orders.models import OrderItem
+        
+        for i in range(10):
+            order = Order.objects.create(user=test_user, total_amount=100.00, shipping_address='Test address')
+            OrderItem.objects.create(order=order, product=product, quantity=1, price_at_purchase=100.00)
+            if i % 2:
+                OrderItem.objects.create(order=order, product=product, quantity=2, price_at_purchase=100.00)
+        
+        # Count plus one page of annotated orders
+        with django_assert_num_queries(2):
+            response = authenticated_client.get('/api/orders/')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert sorted(order['items_count'] for order in response.data['results']) == [1] * 5 + [2] * 5
+    
+    def test_order_detail_compact_and_expanded(self, authenticated_client, test_user, product, django_assert_num_queries):
+        """Test order detail renders compact lines unless products are expanded"""
+        from orders.models import OrderItem
+        
+        order = Order.objects.create(user=test_user, total_amount=100.00, shipping_address='Test address')
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, price_at_purchase=100.00, subtotal=100.00)
+            for _ in range(20)
+        ])
+        
+        # Order with user, then items with products
+        with django_assert_num_queries(2):
+            response = authenticated_client.get(f'/api/orders/{order.id}/')
+        
+        assert response.data['user_email'] == 'test@example.com'
+        assert response.data['items'][0]['product'] == product.id
+        assert response.data['items'][0]['product_name'] == 'Test Product'
+        
+        with django_assert_num_queries(2):
+            response = authenticated_client.get(f'/api/orders/{order.id}/?expand=product')
+        
+        assert response.data['items'][0]['product']['category_name'] == 'Electronics'
+    
+    def test_sales_rollups_follow_payment_and_cancellation(self, authenticated_client, test_user, cart_with_items, product):
+        """Test paid orders feed the sales rollups and cancelling one takes it back out"""
+        from orders.models import DailySalesRollup, ProductSalesRollup
+        from orders.rollups import rebuild_rollups, record_order_sale
+        
+        response = authenticated_client.post('/api/orders/create_order/', {'shipping_address': 'Test address'})
+        order = Order.objects.get(id=response.data['id'])
+        order.payment_status, order.status = 'success', 'paid'
+        order.save()
+        record_order_sale(order)
+        
+        rollup = ProductSalesRollup.objects.get(product=product)
+        day = DailySalesRollup.objects.get()
+        assert (rollup.quantity_sold, rollup.revenue) == (2, 200)
+        assert (day.revenue, day.orders_count, day.items_sold) == (200, 1, 2)
+        assert rebuild_rollups() == (1, 1)
+        assert ProductSalesRollup.objects.get(product=product).quantity_sold == 2
+        
+        test_user.is_staff = True
+        test_user.save()
+        response = authenticated_client.patch(f'/api/orders/{order.id}/update_status/', {'status': 'cancelled'})
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert ProductSalesRollup.objects.get(product=product).quantity_sold == 0
+        assert DailySalesRollup.objects.get().orders_count == 0
+        assert rebuild_rollups() == (0, 0)
+    
+    def test_repeated_payment_verify_counts_once(self, authenticated_client, test_user, cart_with_items, product):
+        """Test a repeated verify neither records the sale twice nor revives a cancelled order"""
+        import hashlib
+        import hmac
+        from django.conf import settings
+        from orders.models import ProductSalesRollup
+        from payments.models import Payment
+        
+        response = authenticated_client.post('/api/orders/create_order/', {'shipping_address': 'Test address'})
+        order = Order.objects.get(id=response.data['id'])
+        Payment.objects.create(order=order, razorpay_order_id='order_1', amount=order.total_amount)
+        signature = hmac.new(settings.RAZORPAY_KEY_SECRET.encode(), b'order_1|pay_1', hashlib.sha256).hexdigest()
+        data = {
+            'order_id': order.id, 'razorpay_order_id': 'order_1',
+            'razorpay_payment_id': 'pay_1', 'razorpay_signature': signature,
+        }
+        
+        for _ in range(2):
+            response = authenticated_client.post('/api/payments/verify/', data)
+            assert response.status_code == status.HTTP_200_OK
+        assert ProductSalesRollup.objects.get(product=product).quantity_sold == 2
+        
+        test_user.is_staff = True
+        test_user.save()
+        authenticated_client.patch(f'/api/orders/{order.id}/update_status/', {'status': 'cancelled'})
+        response = authenticated_client.post('/api/payments/verify/', data)
+        
+        assert response.status_code == status.HTTP_409_CONFLICT
+        order.refresh_from_db()
+        product.refresh_from_db()
+        assert order.status == 'cancelled'
+        assert product.stock == 8
+        assert ProductSalesRollup.objects.get(product=product).quantity_sold == 0
+    
+    def test_sales_report_buckets(self, authenticated_client, test_user, django_assert_num_queries):
+        """Test the sales report reads closed days from the rollup and adds today's orders"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from orders.models import DailySalesRollup
+        
+        today = timezone.localdate()
+        DailySalesRollup.objects.bulk_create([
+            DailySalesRollup(date=today - timedelta(days=1), revenue=100, orders_count=2, items_sold=3),
+            DailySalesRollup(date=today - timedelta(days=2), revenue=50, orders_count=1, items_sold=1),
+            DailySalesRollup(date=today - timedelta(days=60), revenue=999, orders_count=9, items_sold=9),
+        ])
+        Order.objects.create(
+            user=test_user, total_amount=25, shipping_address='Test address', status='paid', payment_status='success'
+        )
+        Order.objects.create(user=test_user, total_amount=40, shipping_address='Test address')
+        test_user.is_staff = True
+        test_user.save()
+        
+        # Closed days from the rollup, today from the orders
+        with django_assert_num_queries(2):
+            response = authenticated_client.get('/api/orders/sales_report/?days=30')
+        
+        assert response.data['total_orders'] == 4
+        assert response.data['total_revenue'] == 175
+        assert [row['count'] for row in response.data['daily_breakdown']] == [1, 2, 1]
+        
+        response = authenticated_client.get('/api/orders/sales_report/?days=90&granularity=month')
+        assert response.data['total_orders'] == 13
+        assert all(row['month'].day == 1 for row in response.data['monthly_breakdown'])
+        
+        response = authenticated_client.get('/api/orders/sales_report/?granularity=year')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_checkout_never_oversells():
+    """Test concurrent checkouts and cancels keep stock consistent"""
+    from io import StringIO
+    from django.core.management import call_command
+    
+    out = StringIO()
+    call_command('loadtest_checkout', workers=4, checkouts=10, stock=15, stdout=out)
+    
+    assert 'No oversell, no negative stock' in out.getvalue()
+    assert not Product.objects.exists()
+
+
+@pytest.fixture
+def async_checkout(settings):
+    from ecommerce_backend.celery import app
+    
+    settings.CHECKOUT_MODE = 'async'
+    # Run tasks in-process; the namespaced key is the one loaded from Django settings
+    eager = app.conf.CELERY_TASK_ALWAYS_EAGER
+    app.conf.CELERY_TASK_ALWAYS_EAGER = True
+    yield
+    app.conf.CELERY_TASK_ALWAYS_EAGER = eager
+
+
+@pytest.mark.django_db
+class TestAsyncCheckout:
+    
+    def test_create_order_returns_ticket(self, authenticated_client, cart_with_items, product, async_checkout):
+        """Test async checkout answers 202 and the worker creates the order"""
+        response = authenticated_client.post('/api/orders/create_order/', {'shipping_address': 'Test address'})
+        
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.data['status'] == 'queued'
+        
+        response = authenticated_client.get(response.data['status_url'])
+        
+        assert response.data['status'] == 'completed'
+        assert float(response.data['order']['total_amount']) == 200.00
+        product.refresh_from_db()
+        assert product.stock == 8
+        assert not cart_with_items.items.exists()
+        
+        for ticket in ('abc', 'deadbeef-0000'):
+            response = authenticated_client.get(f'/api/orders/checkout-status/{ticket}/')
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+    
+    def test_batch_allocates_stock_in_queue_order(self, test_user, product, category):
+        """Test one batch fills tickets oldest first and fails the rest"""
+        from orders.models import CheckoutTicket
+        from orders.services import process_checkout_queue
+        
+        users = [test_user] + [
+            User.objects.create_user(username=f'buyer{i}', email=f'buyer{i}@example.com', password='x')
+            for i in range(2)
+        ]
+        for user in users:
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=product, quantity=4)
+            CheckoutTicket.objects.create(user=user, shipping_address='Test address')
+        
+        assert process_checkout_queue() == 3
+        
+        tickets = list(CheckoutTicket.objects.order_by('created_at'))
+        assert [ticket.status for ticket in tickets] == ['completed', 'completed', 'failed']
+        assert 'Insufficient stock' in tickets[2].error
+        assert tickets[0].order.items.get().subtotal == 400
+        product.refresh_from_db()
+        assert product.stock == 2
+        assert CartItem.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_export_streams_orders_and_items(api_client, test_user, product):
+    """Test the admin export streams CSV and JSON Lines within the date range"""
+    import csv
+    import io
+    import json
+    from datetime import timedelta
+    from django.core.management import call_command
+    from django.utils import timezone
+    from orders.models import OrderItem
+    
+    for i in range(3):
+        order = Order.objects.create(user=test_user, total_amount=100.00, shipping_address=f'Street {i}, "Block A"')
+        OrderItem.objects.create(order=order, product=product, quantity=1, price_at_purchase=100.00)
+    Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=10))
+    test_user.is_staff = True
+    test_user.save()
+    api_client.force_authenticate(user=test_user)
+    
+    response = api_client.get('/api/orders/export/')
+    assert response['Content-Type'] == 'text/csv'
+    rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+    assert len(rows) == 3
+    assert rows[0]['shipping_address'] == 'Street 0, "Block A"'
+    
+    start = (timezone.localdate() - timedelta(days=1)).isoformat()
+    response = api_client.get(f'/api/orders/export/?export=items&output=jsonl&start={start}')
+    lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+    assert [line['product__name'] for line in lines] == ['Test Product'] * 2
+    
+    response = api_client.get('/api/orders/export/?output=xml')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    
+    out = io.StringIO()
+    call_command('export_orders', '--output', 'jsonl', '--chunk-size', '1', stdout=out, stderr=io.StringIO())
+    assert len(out.getvalue().splitlines()) == 3
@@ -1,7 +1,10 @@
+import io
 import pytest
 from rest_framework.test import APIClient
 from rest_framework import status
 from products.models import Category, Product
+from products.search import search_backend
+from ecommerce_backend.pagination import OrderingCursorPagination
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -99,4 +102,407 @@ class TestProducts:
         response = api_client.post('/api/products/', data)
         
         assert response.status_code == status.HTTP_201_CREATED
-        assert Product.objects.filter(name='New Product').exists()
\ No newline at end of file
+        assert Product.objects.filter(name='New Product').exists()
+    
+    def test_category_tree_single_query(self, api_client, category, django_assert_num_queries):
+        """Test category tree is built from one flat fetch"""
+        phones = Category.objects.create(name='Phones', parent=category)
+        Category.objects.create(name='Android', parent=phones)
+        Category.objects.create(name='Laptops', parent=category)
+        
+        with django_assert_num_queries(1):
+            response = api_client.get('/api/categories/all/')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data) == 4
+        root = next(c for c in response.data if c['id'] == category.id)
+        assert {c['name'] for c in root['children']} == {'Phones', 'Laptops'}
+        phones_data = next(c for c in root['children'] if c['name'] == 'Phones')
+        assert phones_data['children'][0]['name'] == 'Android'
+    
+    def test_filter_by_category_with_descendants(self, api_client, product, category):
+        """Test filtering a category subtree via its materialized path"""
+        phones = Category.objects.create(name='Phones', parent=category)
+        android = Category.objects.create(name='Android', parent=phones)
+        other = Category.objects.create(name='Books')
+        Product.objects.create(name='Pixel', category=android, price=500, stock=3)
+        Product.objects.create(name='Novel', category=other, price=10, stock=3)
+        
+        assert android.path == f'{category.id}/{phones.id}/{android.id}/'
+        
+        response = api_client.get(f'/api/products/?category={category.slug}&include_descendants=true')
+        assert response.data['count'] == 2
+        
+        response = api_client.get(f'/api/products/?category={phones.slug}&include_descendants=true')
+        assert response.data['count'] == 1
+        
+        # Moving a subtree rewrites the paths below it
+        phones.parent = other
+        phones.save()
+        android.refresh_from_db()
+        assert android.path == f'{other.id}/{phones.id}/{android.id}/'
+        
+        response = api_client.get(f'/api/products/?category={other.slug}&include_descendants=true')
+        assert response.data['count'] == 2
+    
+    def test_list_products_served_from_cache(self, api_client, product, django_assert_num_queries):
+        """Test repeated listings hit the cache until the catalog changes"""
+        first = api_client.get('/api/products/?ordering=price')
+        
+        with django_assert_num_queries(0):
+            second = api_client.get('/api/products/?ordering=price')
+        assert second.data == first.data
+        
+        product.name = 'Renamed Product'
+        product.save()
+        
+        response = api_client.get('/api/products/?ordering=price')
+        assert response.data['results'][0]['name'] == 'Renamed Product'
+    
+    def test_cursor_pagination(self, api_client, category, monkeypatch):
+        """Test keyset pagination walks the price ordering without gaps"""
+        monkeypatch.setattr(OrderingCursorPagination, 'page_size', 2)
+        for i in range(5):
+            Product.objects.create(name=f'Item {i}', category=category, price=10, stock=1)
+        
+        names = []
+        pages = 0
+        url = '/api/products/?pagination=cursor&ordering=price'
+        while url:
+            pages += 1
+            response = api_client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+            names += [p['name'] for p in response.data['results']]
+            url = response.data['next']
+        
+        assert pages == 3
+        assert sorted(names) == [f'Item {i}' for i in range(5)]
+    
+    def test_list_products_without_count(self, api_client, product):
+        """Test ?count=false skips the total count"""
+        response = api_client.get('/api/products/?count=false')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] is None
+        assert response.data['next'] is None
+        assert response.data['results'][0]['name'] == 'Test Product'
+    
+    def test_search_ranked_prefix_match(self, api_client, product, category):
+        """Test full-text search ranks name matches first and matches prefixes"""
+        Product.objects.create(
+            name='Wireless Mouse', category=category, price=20, stock=5,
+            description='Pairs with any keyboard'
+        )
+        Product.objects.create(
+            name='Mechanical Keyboard', category=category, price=80, stock=5,
+            description='Wireless keyboard with backlight'
+        )
+        
+        assert search_backend() == 'sqlite'
+        
+        response = api_client.get('/api/products/?search=keyb')
+        assert [p['name'] for p in response.data['results']] == ['Mechanical Keyboard', 'Wireless Mouse']
+        
+        response = api_client.get('/api/products/?search=wireless keyboard')
+        assert response.data['results'][0]['name'] == 'Mechanical Keyboard'
+        
+        # Renames are picked up by the index triggers
+        product.name = 'Keyboard Cover'
+        product.save()
+        response = api_client.get('/api/products/?search=cover')
+        assert response.data['count'] == 1
+    
+    def test_suggest_products_and_categories(self, api_client, product, category):
+        """Test type-ahead suggestions follow product saves"""
+        Product.objects.create(name='Electric Kettle', category=category, price=30, stock=2)
+        
+        response = api_client.get('/api/products/suggest/?q=ele')
+        assert response.status_code == status.HTTP_200_OK
+        assert {(s['type'], s['name']) for s in response.data} == {
+            ('category', 'Electronics'), ('product', 'Electric Kettle')
+        }
+        
+        # Word prefixes inside a name match too
+        response = api_client.get('/api/products/suggest/?q=prod')
+        assert [s['id'] for s in response.data] == [product.id]
+        
+        product.is_active = False
+        product.save()
+        response = api_client.get('/api/products/suggest/?q=prod')
+        assert response.data == []
+    
+    def test_list_products_with_facets(self, api_client, product, category, django_assert_num_queries):
+        """Test facets are computed for the current filters in one query"""
+        books = Category.objects.create(name='Books')
+        Product.objects.create(name='Test Novel', category=books, price=750, stock=0)
+        Product.objects.create(name='Test Laptop', category=category, price=60000, stock=4)
+        
+        # Page count, page rows and one aggregated facet query
+        with django_assert_num_queries(3):
+            response = api_client.get('/api/products/?search=test&facets=category,price,in_stock')
+        
+        facets = response.data['facets']
+        assert facets['category'][0] == {
+            'id': category.id, 'name': 'Electronics', 'slug': category.slug, 'count': 2
+        }
+        assert [bucket['count'] for bucket in facets['price']] == [1, 1, 0, 0, 0, 1]
+        assert facets['in_stock'] == {'in_stock': 2, 'out_of_stock': 1}
+        
+        response = api_client.get('/api/products/?max_price=1000&facets=in_stock')
+        assert response.data['facets'] == {'in_stock': {'in_stock': 1, 'out_of_stock': 1}}
+    
+    def test_analytics_dashboard_cached(self, api_client, admin_user, product, settings, django_assert_num_queries):
+        """Test the dashboard is built in a handful of queries and then served from the cache"""
+        api_client.force_authenticate(user=admin_user)
+        
+        # Status counts, catalog totals, revenue, top products, low stock, recent orders
+        with django_assert_num_queries(6):
+            response = api_client.get('/api/products/analytics/')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['total_products'] == 1
+        assert response.data['total_categories'] == 1
+        assert response.data['orders_by_status'] == []
+        
+        Product.objects.create(name='Second Product', category=product.category, price=10, stock=50)
+        with django_assert_num_queries(0):
+            response = api_client.get('/api/products/analytics/')
+        assert response.data['total_products'] == 1
+        
+        # Past the TTL the stale copy is rebuilt
+        settings.ANALYTICS_CACHE_TTL = -1
+        response = api_client.get('/api/products/analytics/')
+        assert response.data['total_products'] == 2
+    
+    def test_import_products_feed(self, api_client, admin_user, product, category, tmp_path):
+        """Test a feed upserts by slug, numbers repeated names and reports bad rows"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.core.management import call_command
+        
+        Product.objects.filter(id=product.id).update(is_active=False)
+        feed = (
+            'name,slug,category,price,stock\n'
+            f'Renamed Product,{product.slug},Electronics,120.50,7\n'
+            'Cable,,electronics,5,100\n'
+            'Cable,,electronics,6,50\n'
+            'Ghost,,no-such-category,5,1\n'
+            'Broken,,electronics,free,1\n'
+        )
+        api_client.force_authenticate(user=admin_user)
+        response = api_client.post(
+            '/api/products/import/', {'file': SimpleUploadedFile('feed.csv', feed.encode())}, format='multipart'
+        )
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert (response.data['rows'], response.data['imported'], response.data['failed']) == (5, 3, 2)
+        assert [error['row'] for error in response.data['errors']] == [4, 5]
+        product.refresh_from_db()
+        assert (product.name, product.price, product.stock) == ('Renamed Product', 120.50, 7)
+        # Columns missing from the feed are left as they were
+        assert (product.description, product.is_active) == ('Test description', False)
+        assert list(Product.objects.filter(name='Cable').order_by('slug').values_list('slug', 'stock')) == [
+            ('cable', 100), ('cable-2', 50)
+        ]
+        
+        # Re-importing the same feed updates the same rows
+        path = tmp_path / 'feed.csv'
+        path.write_text(feed)
+        call_command('import_products', str(path), '--chunk-size', '2', stdout=io.StringIO(), stderr=io.StringIO())
+        assert Product.objects.count() == 3
+        
+        response = api_client.get('/api/products/suggest/?q=cab')
+        assert len(response.data) == 2
+        
+        # Numbering skips slugs given explicitly, and an explicit slug cannot take a numbered one
+        feed = (
+            'name,slug,category,price\n'
+            'Lamp,lamp-2,electronics,5\n'
+            'Lamp,,electronics,5\n'
+            'Lamp,,electronics,5\n'
+            'Desk Lamp,lamp,electronics,5\n'
+        )
+        response = api_client.post(
+            '/api/products/import/', {'file': SimpleUploadedFile('lamps.csv', feed.encode())}, format='multipart'
+        )
+        assert (response.data['imported'], response.data['failed']) == (3, 1)
+        assert response.data['errors'][0]['row'] == 4
+        assert sorted(Product.objects.filter(name='Lamp').values_list('slug', flat=True)) == [
+            'lamp', 'lamp-2', 'lamp-3'
+        ]
+        
+        # Values the product API or the columns would reject are row errors, not a failed run
+        feed = 'name,category,price,stock\nFree,electronics,0,1\nHoard,electronics,5,99999999999\n'
+        response = api_client.post(
+            '/api/products/import/', {'file': SimpleUploadedFile('bad.csv', feed.encode())}, format='multipart'
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert (response.data['imported'], response.data['failed']) == (0, 2)
+    
+    def test_admin_actions_need_admin(self, api_client, category):
+        """Test custom admin actions are not open to regular users"""
+        user = User.objects.create_user(username='shopper', email='shopper@test.com', password='Shopper123!')
+        api_client.force_authenticate(user=user)
+        
+        assert api_client.get('/api/products/low_stock/').status_code == status.HTTP_403_FORBIDDEN
+        assert api_client.post('/api/products/import/', {}).status_code == status.HTTP_403_FORBIDDEN
+    
+    def test_bulk_update_stock_and_price(self, api_client, admin_user, product, category, django_assert_num_queries):
+        """Test a warehouse batch sets or adjusts many products in one transaction"""
+        others = Product.objects.bulk_create([
+            Product(name=f'Bulk {i}', slug=f'bulk-{i}', category=category, price=10, stock=5) for i in range(50)
+        ])
+        api_client.force_authenticate(user=admin_user)
+        updates = [{'id': p.id, 'stock': 20} for p in others] + [{'id': product.id, 'price': '79.00'}, {'id': 999999, 'stock': 1}]
+        
+        # Savepoint, locked read, one CASE update, release
+        with django_assert_num_queries(4):
+            response = api_client.post('/api/products/bulk_update/', {'updates': updates}, format='json')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {'updated': 51, 'missing': [999999]}
+        assert set(Product.objects.filter(slug__startswith='bulk-').values_list('stock', flat=True)) == {20}
+        product.refresh_from_db()
+        assert (float(product.price), product.stock) == (79.00, 10)
+        
+        response = api_client.post('/api/products/bulk_update/', {'mode': 'adjust', 'updates': [
+            {'id': product.id, 'stock': -3}, {'id': others[0].id, 'stock': -25},
+        ]}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert list(response.data['updates']) == [1]
+        product.refresh_from_db()
+        assert product.stock == 10
+        
+        response = api_client.post('/api/products/bulk_update/', {'mode': 'adjust', 'updates': [
+            {'id': product.id, 'stock': -3}
+        ]}, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        product.refresh_from_db()
+        assert product.stock == 7
+        
+        # Out of range values are rejected, not passed on to the database
+        response = api_client.post('/api/products/bulk_update/', {'updates': [
+            {'id': product.id, 'stock': 10 ** 20}
+        ]}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        response = api_client.post('/api/products/bulk_update/', {'mode': 'adjust', 'updates': [
+            {'id': product.id, 'price': '99999999.00'}
+        ]}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert list(response.data['updates']) == [0]
+    
+    def test_short_prefix_ranks_newest_candidates(self, api_client, category, monkeypatch):
+        """Test a short last word only ranks the newest matches"""
+        from products import search
+        
+        if not search.search_backend():
+            pytest.skip('No full-text backend')
+        monkeypatch.setattr(search, 'PREFIX_CANDIDATES', 2)
+        products = [
+            Product.objects.create(name=f'Lamp {i}', category=category, price=10, stock=1, slug=f'lamp-{i}')
+            for i in range(3)
+        ]
+        
+        response = api_client.get('/api/products/?search=lam')
+        assert {p['id'] for p in response.data['results']} == {products[1].id, products[2].id}
+        
+        response = api_client.get('/api/products/?search=lamp')
+        assert len(response.data['results']) == 3
+        
+        # Newer matches outside the filters do not push out the filtered ones
+        other = Category.objects.create(name='Lighting')
+        for i in range(3):
+            Product.objects.create(name=f'Lamp {i}', category=other, price=10, stock=1, slug=f'other-lamp-{i}')
+        Product.objects.create(name='Lamp Hidden', category=category, price=10, stock=1, is_active=False)
+        response = api_client.get(f'/api/products/?search=lam&category={category.slug}')
+        assert {p['id'] for p in response.data['results']} == {products[1].id, products[2].id}
+    
+    def test_suggestion_index_rebuilds_once(self, api_client, product, settings):
+        """Test stock saves keep the index, and a stale index is served while another process rebuilds"""
+        from django.core.cache import cache
+        from products.cache import bump_suggestion_version, get_suggestion_version
+        from products.suggest import REBUILD_LOCK_KEY, PrefixIndex, get_suggestion_index
+        
+        index = get_suggestion_index()
+        version = get_suggestion_version()
+        product.stock = 3
+        product.save()
+        assert get_suggestion_version() == version
+        
+        # Another process renamed something and is rebuilding, keep the current index meanwhile
+        bump_suggestion_version()
+        cache.add(REBUILD_LOCK_KEY, True)
+        assert get_suggestion_index().version == version
+        cache.delete(REBUILD_LOCK_KEY)
+        assert get_suggestion_index().version == get_suggestion_version()
+        
+        capped = PrefixIndex(max_products=1)
+        capped.load([('product', 2, 'Lamp Two', 'lamp-two'), ('product', 1, 'Lamp One', 'lamp-one')])
+        assert [s['id'] for s in capped.search('lamp')] == [2]
+        capped.upsert('product', 3, 'Lamp Three', 'lamp-three')
+        assert [s['id'] for s in capped.search('lamp')] == [3]
+        assert index is get_suggestion_index()
+    
+    def test_sharded_stock_reads_shards(self, api_client, admin_user, product):
+        """Test stock filters and cart checks use the shard rows and admins cannot overwrite them"""
+        from products.inventory import enable_sharding
+        from products.models import ProductStockShard
+        
+        enable_sharding(product.id, 2)
+        # Checkouts take sharded stock from the shard rows only, Product.stock still says 10
+        ProductStockShard.objects.filter(product=product).update(stock=0)
+        
+        response = api_client.get('/api/products/?in_stock=true&facets=in_stock')
+        assert response.data['count'] == 0
+        assert response.data['facets'] == {'in_stock': {'in_stock': 0, 'out_of_stock': 0}}
+        response = api_client.get('/api/products/?facets=in_stock')
+        assert response.data['facets'] == {'in_stock': {'in_stock': 0, 'out_of_stock': 1}}
+        
+        response = api_client.post('/api/cart/add/', {'product_id': product.id, 'quantity': 1})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        
+        api_client.force_authenticate(user=admin_user)
+        response = api_client.get('/api/products/low_stock/')
+        assert [(row['id'], row['stock']) for row in response.data] == [(product.id, 0)]
+        
+        response = api_client.patch(f'/api/products/{product.id}/', {'stock': 50})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        response = api_client.patch(f'/api/products/{product.id}/', {'name': 'Renamed', 'stock': 10})
+        assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db(transaction=True)
+def test_analytics_dashboard_pool_and_background_refresh(settings, monkeypatch):
+    """Test sections run on pool threads and a stale dashboard is served while a thread rebuilds it"""
+    import threading
+    import time
+    from django.core.cache import cache
+    from products import dashboard
+    
+    threads = set()
+    run_section = dashboard.run_section
+    
+    def record_thread(section):
+        threads.add(threading.get_ident())
+        return run_section(section)
+    
+    monkeypatch.setattr(dashboard, 'run_section', record_thread)
+    settings.ANALYTICS_DASHBOARD_WORKERS = 4
+    category = Category.objects.create(name='Electronics')
+    Product.objects.create(name='First Product', category=category, price=10, stock=5)
+    
+    assert dashboard.get_dashboard()['total_products'] == 1
+    assert threads and threading.get_ident() not in threads
+    built_at = cache.get(dashboard.DASHBOARD_CACHE_KEY)['built_at']
+    
+    Product.objects.create(name='Second Product', category=category, price=10, stock=5)
+    settings.ANALYTICS_CACHE_TTL = -1
+    assert dashboard.get_dashboard()['total_products'] == 1
+    
+    deadline = time.monotonic() + 10
+    while cache.get(dashboard.REFRESH_LOCK_KEY) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    
+    assert cache.get(dashboard.REFRESH_LOCK_KEY) is None
+    assert cache.get(dashboard.DASHBOARD_CACHE_KEY)['built_at'] > built_at
+    settings.ANALYTICS_CACHE_TTL = 60
+    assert dashboard.get_dashboard()['total_products'] == 2